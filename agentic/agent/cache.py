@@ -0,0 +1,208 @@
+# agent/cache.py
+"""
+Two-tier TTL cache shared by the providers: an in-memory LRU in front of an
+optional SQLite store so warm entries survive restarts.
+
+Entries are fresh until their TTL runs out, then stale (still servable while a
+refresh runs) for `stale_ttl` more seconds, then gone.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "agent_cache.sqlite3"
+)
+# Set AGENT_CACHE_PATH to an empty string to keep caches in memory only.
+CACHE_PATH = os.getenv("AGENT_CACHE_PATH", _DEFAULT_CACHE_PATH)
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+_registry: Dict[str, "TieredCache"] = {}
+
+
+class _SqliteStore:
+    """Tiny key/value table keyed by (namespace, key); safe across threads."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                fresh_until REAL NOT NULL,
+                stale_until REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, fresh_until, stale_until FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def set(self, namespace: str, key: str, value: Any, fresh_until: float, stale_until: float):
+        payload = json.dumps(value, default=str)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, payload, fresh_until, stale_until),
+            )
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def purge_expired(self, now: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE stale_until < ?", (now,))
+
+
+_store: Optional[_SqliteStore] = None
+_store_lock = threading.Lock()
+_store_error: Optional[Exception] = None
+
+
+def _get_store() -> Optional[_SqliteStore]:
+    global _store, _store_error
+    if not CACHE_PATH or _store_error is not None:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = _SqliteStore(CACHE_PATH)
+                    _store.purge_expired(time.time())
+                except Exception as exc:  # pragma: no cover - disk issues fall back to memory
+                    _store_error = exc
+                    return None
+    return _store
+
+
+class TieredCache:
+    """
+    LRU + optional SQLite cache for JSON-serializable values.
+    `get` returns (status, value) where status is FRESH, STALE or MISS.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        stale_ttl: float = 0.0,
+        max_entries: int = 1024,
+        persist: bool = True,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries: "OrderedDict[str, Tuple[Any, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+        }
+        _registry[namespace] = self
+
+    def _remember(self, key: str, entry: Tuple[Any, float, float]):
+        # caller holds self._lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, key: str) -> Tuple[str, Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        source = "hits"
+        if entry is None and self.persist:
+            store = _get_store()
+            entry = store.get(self.namespace, key) if store else None
+            if entry is not None:
+                source = "disk_hits"
+                with self._lock:
+                    self._remember(key, entry)
+
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                with self._lock:
+                    self._stats[source] += 1
+                return FRESH, value
+            if now < stale_until:
+                with self._lock:
+                    self._stats["stale_hits"] += 1
+                return STALE, value
+            with self._lock:
+                self._entries.pop(key, None)
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return MISS, None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        fresh_until = now + (self.ttl if ttl is None else ttl)
+        stale_until = fresh_until + self.stale_ttl
+        with self._lock:
+            self._remember(key, (value, fresh_until, stale_until))
+            self._stats["sets"] += 1
+        if self.persist:
+            store = _get_store()
+            if store is not None:
+                try:
+                    store.set(self.namespace, key, value, fresh_until, stale_until)
+                except Exception:
+                    pass  # the memory tier still has it
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.persist:
+            store = _get_store()
+            if store is not None:
+                store.delete(self.namespace, key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._stats)
+            data["size"] = len(self._entries)
+        lookups = data["hits"] + data["disk_hits"] + data["stale_hits"] + data["misses"]
+        data["hit_rate"] = round((lookups - data["misses"]) / lookups, 3) if lookups else None
+        return data
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters for every cache created in this process, keyed by namespace."""
+    return {name: cache.stats() for name, cache in _registry.items()}
@@ -1,20 +1,31 @@
+import asyncio
 import json
 import os
 import re
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
     ToolMessage,
 )
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool, tool
 from langchain_google_genai import ChatGoogleGenerativeAI
+from .context_compactor import encode_context
+from .conversation import estimate_tokens, transcript, window_conversation
 from .providers.weather import geocode_location, get_weather_daily
-from .providers.search import search_pois
+from .providers.search import search_pois_async
+from .tools import (
+    favorites_lookup_tool,
+    generate_itinerary_tool,
+    lookup_booking_tool,
+    tavily_search_tool,
+    weather_lookup_tool,
+)
 
 _llm: Optional[ChatGoogleGenerativeAI] = None
 
@@ -83,8 +94,65 @@ async def get_weather_forecast(location: str) -> str:
     return header + "\n" + "\n".join(lines)
 
 
-CHAT_TOOLS = [get_weather_forecast]
-TOOL_MAP = {t.name: t for t in CHAT_TOOLS}
+# Search, weather and itinerary tools from tools.py, exposed to the chat model
+# as-is (they are async and share the app's pools and caches). The booking and
+# favorites lookups are not: see _chat_tools.
+CHAT_TOOLS = [get_weather_forecast] + [
+    StructuredTool.from_function(coroutine=fn)
+    for fn in (
+        tavily_search_tool,
+        weather_lookup_tool,
+        generate_itinerary_tool,
+    )
+]
+
+
+def _context_id(record: Any, *keys: str) -> Optional[int]:
+    if not isinstance(record, dict):
+        return None
+    for key in keys:
+        try:
+            return int(record[key])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def _chat_tools(context: Dict[str, Any]) -> List[Any]:
+    """
+    CHAT_TOOLS plus booking/favorites lookups bound to the booking and traveler
+    of this chat's context. The ids are closed over, never model arguments, so
+    a prompt can't make the model read another traveler's records.
+    """
+    active_booking = context.get("active_booking") if isinstance(context, dict) else None
+    booking_id = _context_id(active_booking, "booking_id", "id")
+    traveler_id = _context_id(context.get("traveler") if isinstance(context, dict) else None, "traveler_id", "id")
+    if traveler_id is None:
+        traveler_id = _context_id(active_booking, "traveler_id")
+
+    tools = list(CHAT_TOOLS)
+    if booking_id is not None or traveler_id is not None:
+        async def lookup_booking() -> str:
+            return await lookup_booking_tool(booking_id=booking_id, traveler_id=traveler_id)
+
+        tools.append(StructuredTool.from_function(
+            coroutine=lookup_booking,
+            name="lookup_booking_tool",
+            description=(
+                "Fetch details (dates, guests, status, property name and location) of the "
+                "guest's current booking, or of their most recent bookings."
+            ),
+        ))
+    if traveler_id is not None:
+        async def lookup_favorites() -> str:
+            return await favorites_lookup_tool(traveler_id)
+
+        tools.append(StructuredTool.from_function(
+            coroutine=lookup_favorites,
+            name="favorites_lookup_tool",
+            description="List the guest's favorite properties (name, location, nightly price).",
+        ))
+    return tools
 
 
 def _get_llm() -> Optional[ChatGoogleGenerativeAI]:
@@ -124,12 +192,43 @@ def _message_text(message: BaseMessage) -> str:
     return str(content)
 
 
-async def run_concierge_chat(messages: List[Dict[str, Any]], context: Dict[str, Any]) -> str:
-    if not messages:
-        return "Hello! Tell me about your upcoming trip and I can help plan it."
+NO_LLM_REPLY = (
+    "I'm ready to help plan your trip once a Gemini API key is configured. "
+    "In the meantime, you can use the standard concierge plan generator."
+)
+LLM_UNAVAILABLE_REPLY = (
+    "I couldn't reach the language model just now, but you can still generate a plan "
+    "from the main concierge button and try again shortly."
+)
+EMPTY_CHAT_REPLY = "Hello! Tell me about your upcoming trip and I can help plan it."
+CHAT_TIMEOUT_REPLY = (
+    "Sorry, that took longer than expected. Please try again, or ask for something a bit more specific."
+)
+TOOL_LIMIT_NOTE = "Tool budget reached. Answer now using the information gathered so far."
+
+# Per-turn limits for the tool-call loop.
+CHAT_TOOL_TIMEOUT = float(os.getenv("CHAT_TOOL_TIMEOUT", "15"))
+CHAT_MAX_TOOL_ROUNDS = int(os.getenv("CHAT_MAX_TOOL_ROUNDS", "4"))
+CHAT_TURN_BUDGET = float(os.getenv("CHAT_TURN_BUDGET", "45"))
+# How long keyword-triggered prefetches may hold up the first model call.
+CHAT_PREFETCH_DEADLINE = float(os.getenv("CHAT_PREFETCH_DEADLINE", "2.5"))
+
+# Prefetches that missed the deadline keep running (to warm caches); hold
+# references so they aren't garbage-collected mid-flight.
+_background_prefetches: set = set()
+
 
-    context_str = json.dumps(context or {}, default=str)
-    base_prompt = (
+SUMMARY_PROMPT = (
+    "Update the running summary of a chat between an Airbnb guest and their travel concierge. "
+    "Keep dates, party details, preferences, constraints, decisions and open questions; "
+    "drop pleasantries. Reply with the updated summary only, in a few short bullet points."
+)
+CHAT_SUMMARY_TIMEOUT = float(os.getenv("CHAT_SUMMARY_TIMEOUT", "20"))
+
+
+def _system_prompt(context: Dict[str, Any]) -> str:
+    context_str = encode_context(context)
+    return (
         "You are an AI travel concierge helping Airbnb guests. "
         "Blend warm hospitality with concrete suggestions. "
         "Always leverage any booking details, traveler preferences, weather, favorite properties, "
@@ -139,28 +238,107 @@ async def run_concierge_chat(messages: List[Dict[str, Any]], context: Dict[str,
         f"Context JSON: {context_str}"
     )
 
+
+def _summarizer(llm):
+    async def summarize(previous: Optional[str], messages: List[Dict[str, str]]) -> Optional[str]:
+        prompt = [
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript(messages)}"),
+        ]
+        response = await asyncio.wait_for(llm.ainvoke(prompt), CHAT_SUMMARY_TIMEOUT)
+        return _message_text(response)
+
+    return summarize
+
+
+async def _build_conversation(
+    messages: List[Dict[str, Any]],
+    context: Dict[str, Any],
+    llm=None,
+) -> List[BaseMessage]:
+    """System prompt, rolling summary of older turns, then the recent turns verbatim."""
+    base_prompt = _system_prompt(context)
+    summary, recent = await window_conversation(
+        messages,
+        context,
+        reserved_tokens=estimate_tokens(base_prompt),
+        summarize=_summarizer(llm) if llm is not None else None,
+    )
+
     conversation: List[BaseMessage] = [SystemMessage(content=base_prompt)]
-    for msg in messages:
-        text = msg.get("content") or ""
-        if not text:
-            continue
-        if msg.get("role") == "user":
-            conversation.append(HumanMessage(content=text))
+    if summary:
+        conversation.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+    for msg in recent:
+        if msg["role"] == "user":
+            conversation.append(HumanMessage(content=msg["content"]))
         else:
-            conversation.append(AIMessage(content=text))
+            conversation.append(AIMessage(content=msg["content"]))
+    return conversation
 
-    llm = _get_llm()
-    if llm is None:
-        return (
-            "I'm ready to help plan your trip once a Gemini API key is configured. "
-            "In the meantime, you can use the standard concierge plan generator."
+
+async def _prefetch_weather(location_hint: str, booking_start: Any, booking_end: Any) -> SystemMessage:
+    try:
+        weather_summary = await get_weather_forecast.arun(location_hint)
+        date_context = ""
+        if booking_start and booking_end:
+            date_context = f" (stay {booking_start} to {booking_end})"
+        return SystemMessage(
+            content=f"Automated weather fetch for {location_hint}{date_context}:\n{weather_summary}"
+        )
+    except Exception as exc:  # pragma: no cover - defensive
+        return SystemMessage(
+            content=f"Automated weather fetch for {location_hint} failed: {exc}"
+        )
+
+
+async def _prefetch_dining(location_hint: str, last_user_text: str, lowered: str) -> Optional[SystemMessage]:
+    try:
+        queries = [
+            "best restaurants",
+            "top local dining",
+            "family friendly restaurants" if "kid" in lowered else "popular eateries",
+            last_user_text,
+        ]
+        hits = await search_pois_async(location_hint, queries, max_results=6)
+        top_hits = []
+        seen_titles = set()
+        for hit in hits:
+            title = (hit.get("title") or "").strip()
+            if not title or title in seen_titles:
+                continue
+            seen_titles.add(title)
+            url = hit.get("url") or ""
+            top_hits.append(f"- {title}" + (f" ({url})" if url else ""))
+            if len(top_hits) >= 5:
+                break
+        if not top_hits:
+            return None
+        return SystemMessage(
+            content=(
+                f"Nearby dining suggestions for {location_hint}:\n"
+                + "\n".join(top_hits)
+            )
+        )
+    except Exception as exc:  # pragma: no cover - defensive
+        return SystemMessage(
+            content=f"Automated dining lookup for {location_hint} failed: {exc}"
         )
 
-    llm_with_tools = llm.bind_tools(CHAT_TOOLS)
 
-    # Pre-fetch weather if the latest user message explicitly asks for it and we
-    # have a location from context. This ensures the tool is invoked even if the
-    # LLM fails to call it autonomously.
+async def _prefetch_context(
+    conversation: List[BaseMessage],
+    messages: List[Dict[str, Any]],
+    context: Dict[str, Any],
+    deadline: float,
+) -> None:
+    """
+    Pre-fetch weather/dining context when the latest user message asks for it
+    and we have a location. This ensures the data reaches the model even if it
+    fails to call a tool autonomously. Both lookups run concurrently (search
+    off the event loop); results are appended as they finish, and whatever is
+    not ready by CHAT_PREFETCH_DEADLINE is left to finish in the background
+    (warming the caches) instead of delaying the first model call.
+    """
     last_user_text: Optional[str] = None
     for msg in reversed(messages):
         if msg.get("role") == "user":
@@ -184,130 +362,270 @@ async def run_concierge_chat(messages: List[Dict[str, Any]], context: Dict[str,
             location_hint = match.group(1).strip(" .,!?:;")
 
     lowered = last_user_text.lower() if last_user_text else ""
+    if not (location_hint and lowered):
+        return
+
+    jobs: Dict[str, asyncio.Task] = {}
+    if any(word in lowered for word in weather_keywords):
+        jobs["weather fetch"] = asyncio.create_task(_prefetch_weather(location_hint, booking_start, booking_end))
+    if any(word in lowered for word in dining_keywords):
+        jobs["dining lookup"] = asyncio.create_task(_prefetch_dining(location_hint, last_user_text, lowered))
+    if not jobs:
+        return
+
+    timeout = max(0.0, min(CHAT_PREFETCH_DEADLINE, deadline - asyncio.get_running_loop().time()))
+    try:
+        for finished in asyncio.as_completed(list(jobs.values()), timeout=timeout):
+            message = await finished
+            if message is not None:
+                conversation.append(message)
+    except asyncio.TimeoutError:
+        for label, task in jobs.items():
+            if not task.done():
+                _background_prefetches.add(task)
+                task.add_done_callback(_background_prefetches.discard)
+                conversation.append(SystemMessage(
+                    content=f"Automated {label} for {location_hint} is still running and is not included yet."
+                ))
+
+
+def _parse_tool_call(call: Any) -> Tuple[Optional[str], Optional[str], Dict[str, Any]]:
+    """Normalize a model tool call (dict or object, args as dict or JSON) to (id, name, args)."""
+    if isinstance(call, dict):
+        call_id = call.get("id")
+        call_name = call.get("name") or call.get("function", {}).get("name")
+        raw_args = call.get("args")
+        if raw_args is None:
+            raw_args = call.get("function", {}).get("arguments")
+    else:
+        call_id = getattr(call, "id", None)
+        call_name = getattr(call, "name", None)
+        raw_args = getattr(call, "args", None)
+        if raw_args is None:
+            raw_args = getattr(getattr(call, "function", None), "arguments", None)
+
+    args: Dict[str, Any]
+    if isinstance(raw_args, str):
+        try:
+            args = json.loads(raw_args) if raw_args else {}
+        except json.JSONDecodeError:
+            args = {}
+    elif isinstance(raw_args, dict):
+        args = raw_args
+    else:
+        args = {}
+    return call_id, call_name, args
+
+
+def _remaining(deadline: float) -> float:
+    """Seconds left before `deadline` (loop time); raises TimeoutError once it passed."""
+    left = deadline - asyncio.get_running_loop().time()
+    if left <= 0:
+        raise asyncio.TimeoutError()
+    return left
+
+
+async def _run_tool_call(call: Any, timeout: float, tool_map: Dict[str, Any]) -> ToolMessage:
+    call_id, call_name, args = _parse_tool_call(call)
+    tool_obj = tool_map.get(call_name)
+    if tool_obj is None:
+        tool_output = f"Tool '{call_name}' is not available."
+    else:
+        try:
+            tool_output = await asyncio.wait_for(tool_obj.ainvoke(args), timeout)
+        except asyncio.TimeoutError:
+            tool_output = f"Tool '{call_name}' timed out after {round(timeout, 1)}s."
+        except Exception as exc:  # pragma: no cover - diagnostics only
+            tool_output = f"Tool error: {exc}"
+
+    return ToolMessage(
+        content=str(tool_output),
+        tool_call_id=call_id or call_name or "unknown_tool_call",
+    )
 
-    if location_hint and lowered:
-        if any(word in lowered for word in weather_keywords):
-            try:
-                weather_summary = await get_weather_forecast.arun(location_hint)
-                date_context = ""
-                if booking_start and booking_end:
-                    date_context = f" (stay {booking_start} to {booking_end})"
-                conversation.append(
-                    SystemMessage(
-                        content=f"Automated weather fetch for {location_hint}{date_context}:\n{weather_summary}"
-                    )
-                )
-            except Exception as exc:  # pragma: no cover - defensive
-                conversation.append(
-                    SystemMessage(
-                        content=f"Automated weather fetch for {location_hint} failed: {exc}"
-                    )
-                )
-
-        if any(word in lowered for word in dining_keywords):
-            try:
-                queries = [
-                    "best restaurants",
-                    "top local dining",
-                    "family friendly restaurants" if "kid" in lowered else "popular eateries",
-                    last_user_text,
-                ]
-                hits = search_pois(location_hint, queries, max_results=6)
-                if hits:
-                    top_hits = []
-                    seen_titles = set()
-                    for hit in hits:
-                        title = (hit.get("title") or "").strip()
-                        if not title or title in seen_titles:
-                            continue
-                        seen_titles.add(title)
-                        url = hit.get("url") or ""
-                        top_hits.append(f"- {title}" + (f" ({url})" if url else ""))
-                        if len(top_hits) >= 5:
-                            break
-                    if top_hits:
-                        conversation.append(
-                            SystemMessage(
-                                content=(
-                                    f"Nearby dining suggestions for {location_hint}:\n"
-                                    + "\n".join(top_hits)
-                                )
-                            )
-                        )
-            except Exception as exc:  # pragma: no cover - defensive
-                conversation.append(
-                    SystemMessage(
-                        content=f"Automated dining lookup for {location_hint} failed: {exc}"
-                    )
-                )
+
+def _skipped_tool_calls(calls: List[Any]) -> List[ToolMessage]:
+    """Placeholder results for tool calls that won't run because the tool budget is spent."""
+    messages = []
+    for call in calls:
+        call_id, call_name, _ = _parse_tool_call(call)
+        messages.append(ToolMessage(
+            content=f"Tool '{call_name}' was not run: tool budget exhausted.",
+            tool_call_id=call_id or call_name or "unknown_tool_call",
+        ))
+    return messages
+
+
+async def _run_tool_calls(
+    calls: List[Any],
+    deadline: float,
+    tool_map: Dict[str, Any],
+    on_result=None,
+) -> List[ToolMessage]:
+    """
+    Run every tool call of one model turn concurrently; results keep call order.
+    `on_result(call, message)` is awaited as each call finishes.
+    """
+    timeout = min(CHAT_TOOL_TIMEOUT, _remaining(deadline))
+
+    async def _one(call: Any) -> ToolMessage:
+        message = await _run_tool_call(call, timeout, tool_map)
+        if on_result is not None:
+            await on_result(call, message)
+        return message
+
+    return list(await asyncio.gather(*(_one(call) for call in calls)))
+
+
+async def run_concierge_chat(messages: List[Dict[str, Any]], context: Dict[str, Any]) -> str:
+    if not messages:
+        return EMPTY_CHAT_REPLY
+
+    deadline = asyncio.get_running_loop().time() + CHAT_TURN_BUDGET
+    llm = _get_llm()
+    if llm is None:
+        return NO_LLM_REPLY
+
+    conversation = await _build_conversation(messages, context, llm)
+    tools = _chat_tools(context)
+    tool_map = {t.name: t for t in tools}
+    llm_with_tools = llm.bind_tools(tools)
+    await _prefetch_context(conversation, messages, context, deadline)
 
     try:
-        response: AIMessage = await llm_with_tools.ainvoke(conversation)
+        response: AIMessage = await asyncio.wait_for(llm_with_tools.ainvoke(conversation), _remaining(deadline))
+        rounds = 0
         while getattr(response, "tool_calls", None):
+            if rounds >= CHAT_MAX_TOOL_ROUNDS:
+                # out of tool rounds: answer with what has been gathered so far.
+                # The pending calls still get (skipped) results so every function
+                # call in the history is followed by its response.
+                conversation.append(response)
+                conversation.extend(_skipped_tool_calls(response.tool_calls))
+                conversation.append(SystemMessage(content=TOOL_LIMIT_NOTE))
+                response = await asyncio.wait_for(llm.ainvoke(conversation), _remaining(deadline))
+                break
+            rounds += 1
             conversation.append(response)
-            for call in response.tool_calls:
-                if isinstance(call, dict):
-                    call_id = call.get("id")
-                    call_name = call.get("name") or call.get("function", {}).get("name")
-                    raw_args = call.get("args")
-                    if raw_args is None:
-                        raw_args = call.get("function", {}).get("arguments")
-                else:
-                    call_id = getattr(call, "id", None)
-                    call_name = getattr(call, "name", None)
-                    raw_args = getattr(call, "args", None)
-                    if raw_args is None:
-                        raw_args = getattr(getattr(call, "function", None), "arguments", None)
-
-                args: Dict[str, Any]
-                if isinstance(raw_args, str):
-                    try:
-                        args = json.loads(raw_args) if raw_args else {}
-                    except json.JSONDecodeError:
-                        args = {}
-                elif isinstance(raw_args, dict):
-                    args = raw_args
-                else:
-                    args = {}
-
-                tool_obj = TOOL_MAP.get(call_name)
-                if tool_obj is None:
-                    tool_output = f"Tool '{call_name}' is not available."
-                else:
-                    try:
-                        if hasattr(tool_obj, "arun"):
-                            tool_output = await tool_obj.arun(**args)
-                        else:
-                            tool_output = tool_obj.run(**args)
-                    except Exception as exc:  # pragma: no cover - diagnostics only
-                        tool_output = f"Tool error: {exc}"
-
-                conversation.append(
-                    ToolMessage(
-                        content=str(tool_output),
-                        tool_call_id=call_id or call_name or "unknown_tool_call",
-                    )
-                )
-
-            response = await llm_with_tools.ainvoke(conversation)
+            conversation.extend(await _run_tool_calls(response.tool_calls, deadline, tool_map))
+            response = await asyncio.wait_for(llm_with_tools.ainvoke(conversation), _remaining(deadline))
         result = response
+    except asyncio.TimeoutError:
+        return CHAT_TIMEOUT_REPLY
     except AttributeError:
         try:
             response = llm_with_tools.invoke(conversation)
             result = response
         except Exception:
-            return (
-                "I couldn't reach the language model just now, but you can still generate a plan "
-                "from the main concierge button and try again shortly."
-            )
+            return LLM_UNAVAILABLE_REPLY
     except Exception:
-        return (
-            "I couldn't reach the language model just now, but you can still generate a plan "
-            "from the main concierge button and try again shortly."
-        )
+        return LLM_UNAVAILABLE_REPLY
 
     if isinstance(result, BaseMessage):
         return _message_text(result)
     if isinstance(result, dict) and "content" in result:
         return result["content"]
     return str(result)
+
+
+async def _produce_chat_events(
+    llm,
+    conversation: List[BaseMessage],
+    tools: List[Any],
+    deadline: float,
+    queue: asyncio.Queue,
+):
+    """Drive the streaming model/tool rounds, pushing events onto `queue` (None when finished)."""
+    tool_map = {t.name: t for t in tools}
+    llm_with_tools = llm.bind_tools(tools)
+
+    async def report(call: Any, message: ToolMessage):
+        _, call_name, _ = _parse_tool_call(call)
+        await queue.put({"event": "tool_result", "data": {"name": call_name, "content": message.content}})
+
+    try:
+        rounds = 0
+        while True:
+            model = llm_with_tools
+            final_round = rounds >= CHAT_MAX_TOOL_ROUNDS
+            if final_round:
+                conversation.append(SystemMessage(content=TOOL_LIMIT_NOTE))
+                model = llm
+            gathered: Optional[AIMessageChunk] = None
+            async for chunk in model.astream(conversation):
+                gathered = chunk if gathered is None else gathered + chunk
+                text = _message_text(chunk)
+                if text:
+                    await queue.put({"event": "token", "data": {"text": text}})
+
+            tool_calls = getattr(gathered, "tool_calls", None) if gathered is not None else None
+            if not tool_calls or final_round:
+                break
+
+            rounds += 1
+            conversation.append(gathered)
+            for call in tool_calls:
+                _, call_name, args = _parse_tool_call(call)
+                await queue.put({"event": "tool_call", "data": {"name": call_name, "args": args}})
+            conversation.extend(await _run_tool_calls(tool_calls, deadline, tool_map, on_result=report))
+    except asyncio.TimeoutError:
+        await queue.put({"event": "error", "data": {"message": CHAT_TIMEOUT_REPLY}})
+    except Exception:
+        await queue.put({"event": "error", "data": {"message": LLM_UNAVAILABLE_REPLY}})
+    finally:
+        await queue.put(None)
+
+
+async def stream_concierge_chat(
+    messages: List[Dict[str, Any]],
+    context: Dict[str, Any],
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of run_concierge_chat. Yields events as dicts:
+      {"event": "token", "data": {"text": ...}}            model output as it arrives
+      {"event": "tool_call", "data": {"name", "args"}}     model asked for a tool
+      {"event": "tool_result", "data": {"name", "content"}}
+      {"event": "error", "data": {"message": ...}}
+      {"event": "done", "data": {"reply": full_text}}
+    """
+    if not messages:
+        yield {"event": "token", "data": {"text": EMPTY_CHAT_REPLY}}
+        yield {"event": "done", "data": {"reply": EMPTY_CHAT_REPLY}}
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHAT_TURN_BUDGET
+    llm = _get_llm()
+    if llm is None:
+        yield {"event": "token", "data": {"text": NO_LLM_REPLY}}
+        yield {"event": "done", "data": {"reply": NO_LLM_REPLY}}
+        return
+
+    conversation = await _build_conversation(messages, context, llm)
+    await _prefetch_context(conversation, messages, context, deadline)
+
+    # The model stream runs in its own task so the turn budget can be enforced
+    # here without cancelling across the generator's yields.
+    queue: asyncio.Queue = asyncio.Queue()
+    producer = asyncio.create_task(_produce_chat_events(llm, conversation, _chat_tools(context), deadline, queue))
+    reply_parts: List[str] = []
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                event = {"event": "error", "data": {"message": CHAT_TIMEOUT_REPLY}}
+                producer.cancel()
+            if event is None:
+                break
+            if event["event"] == "token":
+                reply_parts.append(event["data"]["text"])
+            elif event["event"] == "error" and not reply_parts:
+                reply_parts.append(event["data"]["message"])
+            yield event
+            if event["event"] == "error":
+                break
+    finally:
+        producer.cancel()
+
+    yield {"event": "done", "data": {"reply": "".join(reply_parts)}}
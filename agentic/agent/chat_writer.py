@@ -0,0 +1,147 @@
+# agent/chat_writer.py
+"""
+Write-behind persistence for chat_history.
+
+Handlers enqueue messages and return immediately; a background task batches
+them into multi-row INSERTs, flushed when CHAT_FLUSH_BATCH_SIZE rows are
+pending or CHAT_FLUSH_INTERVAL seconds after the first one arrived. A batch
+the DB rejects is kept and retried. `stop()` (called from the app lifespan)
+lets the worker drain the queue and exit, then flushes what is left.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .db import append_chat_messages, run_db
+
+load_dotenv()
+
+CHAT_FLUSH_BATCH_SIZE = max(1, int(os.getenv("CHAT_FLUSH_BATCH_SIZE", "50")))
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "0.5"))
+CHAT_QUEUE_MAX = int(os.getenv("CHAT_QUEUE_MAX", "10000"))
+_POLL_INTERVAL = 0.05
+_STOP = object()  # queue sentinel: drain, write and exit
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWriteBehind:
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: List[Dict[str, Any]] = []
+        self._worker: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._lock = asyncio.Lock()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker and persist every message still queued."""
+        if self._worker is None:
+            return
+        if self.running:
+            # the worker drains up to the sentinel, writes and exits; it is not
+            # cancelled, so a batch already handed to the DB pool is never lost
+            await self._queue.put(_STOP)
+        try:
+            await self._worker
+        except Exception:
+            pass
+        self._worker = None
+        # messages enqueued after the sentinel, and a last retry of failed rows
+        await self.flush()
+        if self._pending:
+            logger.error("dropping %d chat messages that could not be persisted", len(self._pending))
+            self._pending = []
+
+    async def enqueue(self, booking_id: int, role: str, message: str):
+        row = {"booking_id": booking_id, "role": role, "message": message}
+        if not self.running:
+            # no writer (e.g. outside the app): write straight through
+            if not await run_db(append_chat_messages, [row]):
+                logger.warning("could not persist chat message for booking %s", booking_id)
+            return
+        await self._queue.put(row)
+
+    async def flush(self):
+        """Write everything pending or queued right now."""
+        if self._queue is None:
+            return
+        async with self._lock:
+            stop_seen = False
+            while not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is _STOP:
+                    stop_seen = True
+                else:
+                    self._pending.append(row)
+            if stop_seen:
+                # stop() is waiting for the worker to see this; hand it back
+                self._queue.put_nowait(_STOP)
+            await self._write_pending()
+
+    async def _write_pending(self) -> bool:
+        # caller holds self._lock
+        batch, self._pending = self._pending, []
+        if not batch:
+            return True
+        try:
+            written = await run_db(append_chat_messages, batch)
+        except Exception:
+            written = False
+        if written:
+            return True
+        # keep the rows for the next attempt (bounded like the queue)
+        self._pending = batch + self._pending
+        overflow = len(self._pending) - self.max_queue
+        if overflow > 0:
+            del self._pending[:overflow]
+            logger.error("chat write-behind backlog full; dropped %d oldest messages", overflow)
+        logger.warning("chat_history write of %d messages failed; will retry", len(batch))
+        return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            if self._pending:
+                # a failed write is retried after one flush interval
+                await asyncio.sleep(self.flush_interval)
+            else:
+                # items move from the queue straight into _pending (no await
+                # in between), so nothing is held only by this task
+                row = await self._queue.get()
+                if row is _STOP:
+                    break
+                self._pending.append(row)
+            deadline = loop.time() + self.flush_interval
+            while not stopping:
+                while len(self._pending) < self.batch_size and not self._queue.empty():
+                    row = self._queue.get_nowait()
+                    if row is _STOP:
+                        stopping = True
+                        break
+                    self._pending.append(row)
+                remaining = deadline - loop.time()
+                if stopping or len(self._pending) >= self.batch_size or remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, _POLL_INTERVAL))
+            async with self._lock:
+                await self._write_pending()
+
+
+chat_writer = ChatWriteBehind(CHAT_FLUSH_BATCH_SIZE, CHAT_FLUSH_INTERVAL, CHAT_QUEUE_MAX)
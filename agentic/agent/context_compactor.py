@@ -0,0 +1,145 @@
+# agent/context_compactor.py
+"""
+Shrinks the free-form chat `context` the frontend sends (traveler, active
+booking, every booking, favorites, search highlights, ...) to the fields the
+concierge prompt actually uses, under a fixed byte ceiling.
+
+Sections are added in priority order (active booking first) and list sections
+item by item, so when the ceiling is hit it's the least relevant data that is
+left out. Unknown keys, nulls and empty values are dropped, long strings are
+clipped, and bookings are deduplicated by id.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHAT_CONTEXT_MAX_BYTES = int(os.getenv("CHAT_CONTEXT_MAX_BYTES", "4000"))
+CHAT_CONTEXT_MAX_STRING = int(os.getenv("CHAT_CONTEXT_MAX_STRING", "200"))
+CHAT_CONTEXT_MAX_ITEMS = int(os.getenv("CHAT_CONTEXT_MAX_ITEMS", "5"))
+
+# alias -> canonical name, applied before whitelisting
+FIELD_ALIASES = {
+    "id": "booking_id",
+    "startDate": "start_date",
+    "endDate": "end_date",
+    "partyType": "party_type",
+    "property_location": "location",
+    "property_address": "address",
+}
+BOOKING_FIELDS = (
+    "booking_id", "property_name", "location", "address", "start_date", "end_date",
+    "guests", "party_type", "status",
+)
+TRAVELER_FIELDS = ("name", "role")
+PREFS_FIELDS = ("budget", "interests", "mobility_needs", "dietary")
+ITEM_FIELDS = ("name", "property_name", "title", "location", "price_per_night", "url", "snippet")
+
+# (context key, kind, fields) in priority order
+SECTIONS: Tuple[Tuple[str, str, Optional[Tuple[str, ...]]], ...] = (
+    ("active_booking", "record", BOOKING_FIELDS),
+    ("active_booking_location", "value", None),
+    ("traveler", "record", TRAVELER_FIELDS),
+    ("prefs", "record", PREFS_FIELDS),
+    ("preferences", "record", PREFS_FIELDS),
+    ("bookings", "bookings", BOOKING_FIELDS),
+    ("favorites", "list", ITEM_FIELDS),
+    ("search_highlights", "list", ITEM_FIELDS),
+)
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, default=str, ensure_ascii=False, separators=(",", ":"))
+
+
+def _size(value: Any) -> int:
+    return len(_encode(value).encode("utf-8"))
+
+
+def _scalar(value: Any) -> Any:
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        if len(value) > CHAT_CONTEXT_MAX_STRING:
+            value = value[: CHAT_CONTEXT_MAX_STRING - 1].rstrip() + "…"
+        return value or None
+    if isinstance(value, list):
+        items = [_scalar(v) for v in value[:CHAT_CONTEXT_MAX_ITEMS * 2] if not isinstance(v, (dict, list))]
+        return [v for v in items if v is not None] or None
+    if isinstance(value, dict):
+        return None  # nested objects are only kept through an explicit section
+    return value
+
+
+def _record(raw: Any, fields: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    if not isinstance(raw, dict):
+        return None
+    out: Dict[str, Any] = {}
+    for key, value in raw.items():
+        key = FIELD_ALIASES.get(key, key)
+        if key not in fields or key in out:
+            continue
+        value = _scalar(value)
+        if value is not None and value != "":
+            out[key] = value
+    return out or None
+
+
+def _booking_key(record: Dict[str, Any]) -> Any:
+    if record.get("booking_id") is not None:
+        return str(record["booking_id"])
+    return (record.get("location"), record.get("start_date"), record.get("end_date"))
+
+
+def compact_context(context: Optional[Dict[str, Any]], max_bytes: int = CHAT_CONTEXT_MAX_BYTES) -> Dict[str, Any]:
+    """Whitelisted, deduplicated, size-capped copy of a chat context dict."""
+    context = context or {}
+    out: Dict[str, Any] = {}
+    used = 2  # "{}"
+
+    def fits(key: str, value: Any) -> bool:
+        # `"key":value` plus a separating comma
+        return used + _size(key) + 1 + _size(value) + (1 if out else 0) <= max_bytes
+
+    seen_bookings = set()
+    active = _record(context.get("active_booking"), BOOKING_FIELDS)
+    if active:
+        seen_bookings.add(_booking_key(active))
+
+    for key, kind, fields in SECTIONS:
+        raw = context.get(key)
+        if kind == "value":
+            value = _scalar(raw)
+            value = value if not isinstance(value, list) else None
+        elif kind == "record":
+            value = active if key == "active_booking" else _record(raw, fields)
+        else:
+            value = None
+            if isinstance(raw, list):
+                items: List[Dict[str, Any]] = []
+                for entry in raw:
+                    record = _record(entry, fields)
+                    if not record:
+                        continue
+                    if kind == "bookings":
+                        booking_key = _booking_key(record)
+                        if booking_key in seen_bookings:
+                            continue
+                        seen_bookings.add(booking_key)
+                    if len(items) >= CHAT_CONTEXT_MAX_ITEMS or not fits(key, items + [record]):
+                        break
+                    items.append(record)
+                value = items or None
+        if value is None or (key == "preferences" and "prefs" in out):
+            continue
+        if fits(key, value):
+            out[key] = value
+            used = _size(out)
+    return out
+
+
+def encode_context(context: Optional[Dict[str, Any]], max_bytes: int = CHAT_CONTEXT_MAX_BYTES) -> str:
+    """Compact JSON for the system prompt (see compact_context)."""
+    return _encode(compact_context(context, max_bytes))
@@ -0,0 +1,181 @@
+# agent/conversation.py
+"""
+Conversation windowing for the chat endpoints.
+
+Only the newest CHAT_WINDOW_MESSAGES messages are replayed verbatim (fewer if
+they don't fit CHAT_INPUT_TOKEN_BUDGET); everything older is represented by a
+rolling summary. For a known booking the summary is stored in chat_history as
+a role='summary' row whose JSON records how many leading messages it covers
+plus a digest of them, so later turns only fold in what has dropped out of the
+window since.
+
+Folding never blocks a turn: the current prompt uses a cheap extractive
+summary for the not-yet-folded messages, while the model-written summary is
+produced in the background and picked up on the next turn.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .chat_writer import chat_writer
+from .db import get_latest_chat_summary, run_db
+
+load_dotenv()
+
+CHAT_WINDOW_MESSAGES = max(2, int(os.getenv("CHAT_WINDOW_MESSAGES", "12")))
+CHAT_INPUT_TOKEN_BUDGET = int(os.getenv("CHAT_INPUT_TOKEN_BUDGET", "6000"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_ROLE = "summary"
+
+Summarizer = Callable[[Optional[str], List[Dict[str, str]]], Awaitable[Optional[str]]]
+
+# booking_id -> running fold, so one booking never has two folds in flight
+_folds: Dict[int, asyncio.Task] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); good enough for budgeting."""
+    return len(text or "") // 4 + 1
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    limit = max(1, max_tokens) * 4
+    return text if len(text) <= limit else text[: limit - 1].rstrip() + "…"
+
+
+def _clean(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    cleaned = []
+    for msg in messages:
+        content = msg.get("content") or ""
+        if content:
+            cleaned.append({"role": "user" if msg.get("role") == "user" else "assistant", "content": content})
+    return cleaned
+
+
+def _digest(messages: List[Dict[str, str]]) -> str:
+    payload = json.dumps([[m["role"], m["content"]] for m in messages], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _booking_id(context: Dict[str, Any]) -> Optional[int]:
+    active = context.get("active_booking") if isinstance(context, dict) else None
+    if not isinstance(active, dict):
+        return None
+    try:
+        return int(active.get("booking_id") or active.get("id"))
+    except (TypeError, ValueError):
+        return None
+
+
+def transcript(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(
+        f"{'Guest' if m['role'] == 'user' else 'Concierge'}: {m['content']}" for m in messages
+    )
+
+
+def extractive_summary(
+    messages: List[Dict[str, str]],
+    previous: Optional[str] = None,
+    max_tokens: int = CHAT_SUMMARY_MAX_TOKENS,
+) -> str:
+    """Fallback summary: the previous summary plus one clipped line per message, newest kept."""
+    lines = [previous] if previous else []
+    for m in messages:
+        speaker = "Guest" if m["role"] == "user" else "Concierge"
+        lines.append(f"- {speaker}: {_clip(' '.join(m['content'].split()), 40)}")
+    summary = "\n".join(lines)
+    limit = max_tokens * 4
+    if len(summary) > limit:
+        summary = "…" + summary[-(limit - 1):]
+    return summary
+
+
+async def _load_summary(booking_id: Optional[int], older: List[Dict[str, str]]) -> Tuple[int, Optional[str]]:
+    """(messages covered, summary text) of the stored summary, if it matches this history."""
+    if booking_id is None:
+        return 0, None
+    raw = await run_db(get_latest_chat_summary, booking_id)
+    if not raw:
+        return 0, None
+    try:
+        data = json.loads(raw)
+        covered, summary, digest = int(data["covered"]), data["summary"], data["digest"]
+    except (ValueError, TypeError, KeyError):
+        return 0, None
+    # a different (or edited) conversation for the same booking: start over
+    if covered > len(older) or _digest(older[:covered]) != digest:
+        return 0, None
+    return covered, summary
+
+
+async def _fold(
+    booking_id: int,
+    older: List[Dict[str, str]],
+    previous: Optional[str],
+    gap: List[Dict[str, str]],
+    summarize: Optional[Summarizer],
+):
+    summary = None
+    if summarize is not None:
+        try:
+            summary = await summarize(previous, gap)
+        except Exception:
+            summary = None
+    if summary:
+        summary = _clip(summary.strip(), CHAT_SUMMARY_MAX_TOKENS)
+    else:
+        summary = extractive_summary(gap, previous)
+    row = {"covered": len(older), "digest": _digest(older), "summary": summary}
+    await chat_writer.enqueue(booking_id, SUMMARY_ROLE, json.dumps(row, ensure_ascii=False))
+
+
+def _schedule_fold(booking_id: int, *args):
+    running = _folds.get(booking_id)
+    if running is not None and not running.done():
+        return
+    task = asyncio.create_task(_fold(booking_id, *args))
+    _folds[booking_id] = task
+    task.add_done_callback(lambda _: _folds.pop(booking_id, None) if _folds.get(booking_id) is task else None)
+
+
+async def window_conversation(
+    messages: List[Dict[str, Any]],
+    context: Dict[str, Any],
+    reserved_tokens: int = 0,
+    summarize: Optional[Summarizer] = None,
+) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """
+    Split a chat history into (summary, recent messages) for the prompt.
+    `recent` is the verbatim tail that fits the budget left after `reserved_tokens`
+    (system prompt, context); `summary` stands in for everything before it and
+    is None when nothing was dropped. `summarize(previous, messages)` writes the
+    stored summary; without it (or if it fails) an extractive one is stored.
+    """
+    cleaned = _clean(messages)
+    split = max(0, len(cleaned) - CHAT_WINDOW_MESSAGES)
+    budget = max(0, CHAT_INPUT_TOKEN_BUDGET - reserved_tokens - CHAT_SUMMARY_MAX_TOKENS)
+    tail_tokens = sum(estimate_tokens(m["content"]) for m in cleaned[split:])
+    # the newest message always stays; older ones leave the window until it fits
+    while split < len(cleaned) - 1 and tail_tokens > budget:
+        tail_tokens -= estimate_tokens(cleaned[split]["content"])
+        split += 1
+    recent = cleaned[split:]
+    if recent and tail_tokens > budget:
+        recent[-1] = dict(recent[-1], content=_clip(recent[-1]["content"], max(budget, 256)))
+    if split == 0:
+        return None, recent
+
+    older = cleaned[:split]
+    booking_id = _booking_id(context)
+    covered, stored = await _load_summary(booking_id, older)
+    gap = older[covered:]
+    if not gap:
+        return stored, recent
+
+    if booking_id is not None:
+        _schedule_fold(booking_id, older, stored, gap, summarize)
+    return extractive_summary(gap, stored), recent
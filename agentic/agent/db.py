@@ -1,8 +1,16 @@
 # agent/db.py
+import asyncio
+import functools
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, exc as sa_exc, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,19 +18,84 @@ load_dotenv()
 DEFAULT_DB_URL = "sqlite+pysqlite:///:memory:"
 DATABASE_URL = os.getenv("DATABASE_URL", DEFAULT_DB_URL)
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Connections are pinged on checkout only if idle-checked longer ago than this.
+DB_PING_INTERVAL = float(os.getenv("DB_PING_INTERVAL", "30"))
+
 engine = None
 SessionLocal = None
 _db_error: Exception | None = None
+# Set once ensure_property_geo_table() succeeds; until then booking queries
+# skip the coordinates join.
+_property_geo_ready = False
+# Cleared if the hydration query finds no traveler_preferences table.
+_prefs_join_supported = True
+# set once ensure_concierge_plans_table() has created the plan store
+_concierge_plans_ready = False
+
+
+def _engine_kwargs(url:str) -> dict:
+    if url.startswith("sqlite"):
+        if ":memory:" in url:
+            # queries run on the DB thread pool; share the one in-memory DB
+            return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+def _install_interval_ping(eng):
+    """Pessimistic disconnect handling, but at most one ping per interval per connection."""
+
+    @event.listens_for(eng, "connect")
+    def _mark_fresh(dbapi_conn, connection_record):
+        connection_record.info["last_ping"] = time.monotonic()
+
+    @event.listens_for(eng, "checkout")
+    def _ping_if_due(dbapi_conn, connection_record, connection_proxy):
+        now = time.monotonic()
+        if now - connection_record.info.get("last_ping", 0.0) < DB_PING_INTERVAL:
+            return
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception as exc:
+            # the pool discards this connection and retries with a new one
+            raise sa_exc.DisconnectionError() from exc
+        finally:
+            cursor.close()
+        connection_record.info["last_ping"] = now
+
 
 if DATABASE_URL:
     try:
-        engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
+        engine = create_engine(DATABASE_URL, future=True, **_engine_kwargs(DATABASE_URL))
+        _install_interval_ping(engine)
         SessionLocal = sessionmaker(bind=engine)
     except Exception as exc:  # pragma: no cover - diagnostic only
         _db_error = exc
         engine = None
         SessionLocal = None
 
+# Blocking DB calls run here instead of on the event loop. One thread per
+# possible connection means workers never queue on pool checkout.
+_db_executor = ThreadPoolExecutor(
+    max_workers=max(1, DB_POOL_SIZE + DB_MAX_OVERFLOW),
+    thread_name_prefix="agent-db",
+)
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking db.py helper on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+
 def get_booking_with_user(booking_id:int):
     """
     Expect your schema to have:
@@ -30,12 +103,18 @@ def get_booking_with_user(booking_id:int):
       users(id, name, email, phone, ... )
       properties(id, owner_id, location, ...)
     Adjust SELECT to your real table/column names.
+    Includes lat/lon from property_geo when coordinates were precomputed.
     """
     if SessionLocal is None:
         return None
+    geo_cols = "g.lat AS lat, g.lon AS lon" if _property_geo_ready else "NULL AS lat, NULL AS lon"
+    geo_join = (
+        "LEFT JOIN property_geo g ON g.property_id = p.property_id AND g.location = p.location"
+        if _property_geo_ready else ""
+    )
     with SessionLocal() as s:
         try:
-            row = s.execute(text("""
+            row = s.execute(text(f"""
                 SELECT
                     b.booking_id,
                     b.traveler_id,
@@ -47,16 +126,149 @@ def get_booking_with_user(booking_id:int):
                     p.location AS location,
                     p.location AS property_address,
                     p.name AS property_name,
-                    u.name AS traveler_name
+                    u.name AS traveler_name,
+                    {geo_cols}
                 FROM bookings b
                 JOIN properties p ON p.property_id = b.property_id
                 JOIN users u ON u.user_id = b.traveler_id
+                {geo_join}
                 WHERE b.booking_id = :bid
             """), {"bid": booking_id}).mappings().first()
         except Exception:
             return None
         return dict(row) if row else None
 
+
+def _table_exists(name:str) -> bool:
+    """True unless the table is known to be missing (errors count as present)."""
+    try:
+        return inspect(engine).has_table(name)
+    except Exception:
+        return True
+
+
+def _prefs_from_row(row:dict):
+    """Pull the pref_* columns of a hydration row into a Preferences-shaped dict."""
+    if row.get("pref_traveler_id") is None:
+        return None
+    prefs = {}
+    for field in ("budget", "mobility_needs", "dietary"):
+        if row.get(f"pref_{field}") is not None:
+            prefs[field] = row[f"pref_{field}"]
+    interests = row.get("pref_interests")
+    if isinstance(interests, str):
+        try:
+            interests = json.loads(interests)
+        except ValueError:
+            interests = [i.strip() for i in interests.split(",") if i.strip()]
+    if isinstance(interests, list):
+        prefs["interests"] = [str(i) for i in interests]
+    return prefs
+
+
+def get_booking_context(booking_id:int):
+    """
+    One round-trip hydration for the concierge: booking + property + traveler,
+    stored property coordinates and the traveler's latest preferences row
+    (under "prefs", None when absent). Falls back to get_booking_with_user
+    plus get_traveler_prefs when the traveler_preferences table doesn't exist.
+    """
+    global _prefs_join_supported
+    if SessionLocal is None:
+        return None
+    if not _prefs_join_supported:
+        row = get_booking_with_user(booking_id)
+        if row is not None:
+            prefs = get_traveler_prefs(row["traveler_id"]) if row.get("traveler_id") is not None else None
+            row["prefs"] = _prefs_from_row(
+                {"pref_traveler_id": row["traveler_id"], **{f"pref_{k}": v for k, v in prefs.items()}}
+            ) if prefs else None
+        return row
+
+    geo_cols = "g.lat AS lat, g.lon AS lon" if _property_geo_ready else "NULL AS lat, NULL AS lon"
+    geo_join = (
+        "LEFT JOIN property_geo g ON g.property_id = p.property_id AND g.location = p.location"
+        if _property_geo_ready else ""
+    )
+    with SessionLocal() as s:
+        try:
+            row = s.execute(text(f"""
+                SELECT
+                    b.booking_id,
+                    b.traveler_id,
+                    b.property_id,
+                    b.start_date,
+                    b.end_date,
+                    b.guests,
+                    NULL AS party_type,
+                    p.location AS location,
+                    p.location AS property_address,
+                    p.name AS property_name,
+                    u.name AS traveler_name,
+                    {geo_cols},
+                    tp.traveler_id AS pref_traveler_id,
+                    tp.budget AS pref_budget,
+                    tp.interests AS pref_interests,
+                    tp.mobility_needs AS pref_mobility_needs,
+                    tp.dietary AS pref_dietary
+                FROM bookings b
+                JOIN properties p ON p.property_id = b.property_id
+                JOIN users u ON u.user_id = b.traveler_id
+                {geo_join}
+                LEFT JOIN traveler_preferences tp
+                    ON tp.traveler_id = b.traveler_id
+                    AND COALESCE(tp.updated_at, '1970-01-01') = (
+                        SELECT MAX(COALESCE(tp2.updated_at, '1970-01-01')) FROM traveler_preferences tp2
+                        WHERE tp2.traveler_id = b.traveler_id
+                    )
+                WHERE b.booking_id = :bid
+            """), {"bid": booking_id}).mappings().first()
+        except Exception:
+            # only a missing table disables the join; any other error (a
+            # dropped connection, a lock timeout) fails just this lookup
+            if _table_exists("traveler_preferences"):
+                return None
+            _prefs_join_supported = False
+            return get_booking_context(booking_id)
+    if not row:
+        return None
+    data = {k: v for k, v in dict(row).items() if not k.startswith("pref_")}
+    data["prefs"] = _prefs_from_row(dict(row))
+    return data
+
+
+# Request-scoped memo: entities loaded once per request are reused by every
+# helper that asks for them again within the same request.
+_request_memo: ContextVar[dict | None] = ContextVar("agent_request_memo", default=None)
+
+
+@contextmanager
+def request_scope():
+    """Open a memo for the current request (re-entrant: nested scopes share it)."""
+    if _request_memo.get() is not None:
+        yield
+        return
+    token = _request_memo.set({})
+    try:
+        yield
+    finally:
+        _request_memo.reset(token)
+
+
+async def run_db_memoized(key, fn, *args, **kwargs):
+    """run_db, but reuse the result for `key` within the current request_scope."""
+    memo = _request_memo.get()
+    if memo is None:
+        return await run_db(fn, *args, **kwargs)
+    if key not in memo:
+        memo[key] = asyncio.ensure_future(run_db(fn, *args, **kwargs))
+    return await memo[key]
+
+
+async def load_booking_context(booking_id:int):
+    return await run_db_memoized(("booking_context", booking_id), get_booking_context, booking_id)
+
+
 def get_traveler_prefs(traveler_id:int):
     if SessionLocal is None:
         return None
@@ -74,41 +286,264 @@ def get_traveler_prefs(traveler_id:int):
         return dict(row) if row else None
 
 
-def ensure_chat_table():
-    """Create a simple chat_history table if it doesn't exist."""
-    if SessionLocal is None or engine is None:
-        return False
-    with engine.begin() as conn:
-        conn.exec_driver_sql("""
+CHAT_HISTORY_INDEX = "ix_chat_history_booking_id_id"
+
+
+def _chat_table_ddl(dialect:str) -> str:
+    if dialect == "mysql":
+        id_col = "id INTEGER AUTO_INCREMENT PRIMARY KEY"
+        index = f",\n            INDEX {CHAT_HISTORY_INDEX} (booking_id, id)"
+    elif dialect == "sqlite":
+        id_col = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+        index = ""
+    else:
+        id_col = "id SERIAL PRIMARY KEY"
+        index = ""
+    return f"""
         CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {id_col},
             booking_id INTEGER,
-            role TEXT,
+            role VARCHAR(16),
             message TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP{index}
         )
-        """)
+        """
+
+
+def ensure_chat_table():
+    """
+    Create the chat_history table if it doesn't exist, with a composite
+    (booking_id, id) index so per-booking history reads are range scans.
+    """
+    if SessionLocal is None or engine is None:
+        return False
+    with engine.begin() as conn:
+        conn.exec_driver_sql(_chat_table_ddl(engine.dialect.name))
+        # tables created by older versions lack the index
+        existing = {ix.get("name") for ix in inspect(conn).get_indexes("chat_history")}
+        if CHAT_HISTORY_INDEX not in existing:
+            conn.exec_driver_sql(f"CREATE INDEX {CHAT_HISTORY_INDEX} ON chat_history (booking_id, id)")
     return True
 
 
-def append_chat_message(booking_id:int, role:str, message:str):
+def append_chat_messages(rows:list):
+    """Persist many chat messages with a single multi-row INSERT."""
+    if SessionLocal is None or not rows:
+        return False
+    placeholders = []
+    params = {}
+    for idx, row in enumerate(rows):
+        placeholders.append(f"(:bid{idx}, :role{idx}, :msg{idx})")
+        params[f"bid{idx}"] = row["booking_id"]
+        params[f"role{idx}"] = row["role"]
+        params[f"msg{idx}"] = row["message"]
+    with SessionLocal() as s:
+        try:
+            s.execute(text("INSERT INTO chat_history (booking_id, role, message) VALUES " + ", ".join(placeholders)), params)
+            s.commit()
+        except Exception:
+            return False
+    return True
+
+
+def get_chat_history(booking_id:int, limit:int=200, before_id:int|None=None, after_id:int|None=None, latest:bool=False):
+    """
+    Keyset-paginated history for a booking, always returned oldest-first.
+      after_id   -> the `limit` messages following that id
+      before_id  -> the `limit` messages preceding that id
+      latest     -> the newest `limit` messages (before_id = end of history)
+      (neither)  -> the first `limit` messages
+    """
+    if SessionLocal is None:
+        return []
+    params = {"bid": booking_id, "lim": limit}
+    # rolling conversation summaries live in the same table but aren't messages
+    where = "booking_id = :bid AND role <> 'summary'"
+    descending = before_id is not None or (latest and after_id is None)
+    if after_id is not None:
+        where += " AND id > :after"
+        params["after"] = after_id
+    if before_id is not None:
+        where += " AND id < :before"
+        params["before"] = before_id
+    order = "DESC" if descending else "ASC"
+    with SessionLocal() as s:
+        try:
+            rows = s.execute(text(f"SELECT id, role, message, created_at FROM chat_history WHERE {where} ORDER BY id {order} LIMIT :lim"), params).mappings().all()
+        except Exception:
+            return []
+    rows = [dict(r) for r in rows]
+    if descending:
+        rows.reverse()
+    return rows
+
+
+def get_bookings(booking_id:int|None=None, traveler_id:int|None=None, limit:int=5):
+    """One booking by id, or a traveler's most recent `limit` bookings, with property name/location."""
+    if SessionLocal is None:
+        return []
+    where, params = ("b.booking_id = :bid", {"bid": booking_id}) if booking_id is not None else ("b.traveler_id = :tid", {"tid": traveler_id})
+    params["lim"] = limit
+    with SessionLocal() as s:
+        try:
+            rows = s.execute(text(f"""
+                SELECT b.booking_id, b.traveler_id, b.property_id, b.start_date, b.end_date,
+                       b.guests, b.status, p.name AS property_name, p.location
+                FROM bookings b
+                LEFT JOIN properties p ON p.property_id = b.property_id
+                WHERE {where}
+                ORDER BY b.start_date DESC
+                LIMIT :lim
+            """), params).mappings().all()
+        except Exception:
+            return []
+    return [dict(r) for r in rows]
+
+
+def get_favorites(traveler_id:int, limit:int=10):
     if SessionLocal is None:
+        return []
+    with SessionLocal() as s:
+        try:
+            rows = s.execute(text("""
+                SELECT f.favorite_id, p.property_id, p.name, p.location, p.price_per_night
+                FROM favorites f
+                JOIN properties p ON p.property_id = f.property_id
+                WHERE f.traveler_id = :tid
+                ORDER BY f.favorite_id DESC
+                LIMIT :lim
+            """), {"tid": traveler_id, "lim": limit}).mappings().all()
+        except Exception:
+            return []
+    return [dict(r) for r in rows]
+
+
+def get_latest_chat_summary(booking_id:int):
+    """Message body of the newest role='summary' row for a booking (see agent/conversation.py)."""
+    if SessionLocal is None:
+        return None
+    with SessionLocal() as s:
+        try:
+            row = s.execute(text("SELECT message FROM chat_history WHERE booking_id = :bid AND role = 'summary' ORDER BY id DESC LIMIT 1"), {"bid": booking_id}).first()
+        except Exception:
+            return None
+    return row[0] if row else None
+
+
+def ensure_property_geo_table():
+    """Create the property_geo table holding precomputed property coordinates."""
+    global _property_geo_ready
+    if engine is None:
+        return False
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS property_geo (
+                property_id INTEGER PRIMARY KEY,
+                location VARCHAR(255),
+                lat DOUBLE PRECISION,
+                lon DOUBLE PRECISION,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+    except Exception:
+        return False
+    _property_geo_ready = True
+    return True
+
+
+def save_property_coords(property_id:int, location:str, lat:float, lon:float):
+    if SessionLocal is None or not _property_geo_ready:
+        return False
+    with SessionLocal() as s:
+        try:
+            s.execute(text("DELETE FROM property_geo WHERE property_id = :pid"), {"pid": property_id})
+            s.execute(text("INSERT INTO property_geo (property_id, location, lat, lon) VALUES (:pid, :loc, :lat, :lon)"), {"pid": property_id, "loc": location, "lat": lat, "lon": lon})
+            s.commit()
+        except Exception:
+            return False
+    return True
+
+
+def get_properties_missing_coords(limit:int=500):
+    """Properties with no stored coordinates, or whose location changed since."""
+    if SessionLocal is None or not _property_geo_ready:
+        return []
+    with SessionLocal() as s:
+        try:
+            rows = s.execute(text("""
+                SELECT p.property_id, p.location
+                FROM properties p
+                LEFT JOIN property_geo g ON g.property_id = p.property_id
+                WHERE p.location IS NOT NULL
+                  AND (g.property_id IS NULL OR g.location <> p.location)
+                ORDER BY p.property_id
+                LIMIT :lim
+            """), {"lim": limit}).mappings().all()
+        except Exception:
+            return []
+    return [dict(r) for r in rows]
+
+
+def ensure_concierge_plans_table():
+    """Create the concierge_plans table: one stored plan per booking (see agent/precompute.py)."""
+    global _concierge_plans_ready
+    if engine is None:
+        return False
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS concierge_plans (
+                booking_id INTEGER PRIMARY KEY,
+                fingerprint VARCHAR(64) NOT NULL,
+                source VARCHAR(16),
+                response TEXT NOT NULL,
+                computed_at DOUBLE PRECISION NOT NULL
+            )
+            """)
+    except Exception:
+        return False
+    _concierge_plans_ready = True
+    return True
+
+
+def get_concierge_plan(booking_id:int):
+    if SessionLocal is None or not _concierge_plans_ready:
+        return None
+    with SessionLocal() as s:
+        try:
+            row = s.execute(text("SELECT booking_id, fingerprint, source, response, computed_at FROM concierge_plans WHERE booking_id = :bid"), {"bid": booking_id}).mappings().first()
+        except Exception:
+            return None
+    return dict(row) if row else None
+
+
+def save_concierge_plan(booking_id:int, fingerprint:str, source:str, response:str):
+    if SessionLocal is None or not _concierge_plans_ready:
         return False
     with SessionLocal() as s:
         try:
-            s.execute(text("INSERT INTO chat_history (booking_id, role, message) VALUES (:bid, :role, :msg)"), {"bid": booking_id, "role": role, "msg": message})
+            s.execute(text("DELETE FROM concierge_plans WHERE booking_id = :bid"), {"bid": booking_id})
+            s.execute(text("INSERT INTO concierge_plans (booking_id, fingerprint, source, response, computed_at) VALUES (:bid, :fp, :src, :resp, :at)"), {"bid": booking_id, "fp": fingerprint, "src": source, "resp": response, "at": time.time()})
             s.commit()
         except Exception:
             return False
     return True
 
 
-def get_chat_history(booking_id:int, limit:int=200):
+def get_upcoming_bookings(start_from, start_until, limit:int=200):
+    """Accepted bookings whose stay starts within [start_from, start_until]."""
     if SessionLocal is None:
         return []
     with SessionLocal() as s:
         try:
-            rows = s.execute(text("SELECT role, message, created_at FROM chat_history WHERE booking_id = :bid ORDER BY id ASC LIMIT :lim"), {"bid": booking_id, "lim": limit}).mappings().all()
+            rows = s.execute(text("""
+                SELECT booking_id, start_date, end_date
+                FROM bookings
+                WHERE status = 'ACCEPTED' AND start_date >= :start_from AND start_date <= :start_until
+                ORDER BY start_date, booking_id
+                LIMIT :lim
+            """), {"start_from": start_from, "start_until": start_until, "lim": limit}).mappings().all()
         except Exception:
             return []
     return [dict(r) for r in rows]
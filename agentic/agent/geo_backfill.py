@@ -0,0 +1,40 @@
+# agent/geo_backfill.py
+"""
+Bulk-geocode property locations into the property_geo table so concierge
+requests for known properties never need a geocoding call.
+
+Run manually with `python -m agent.geo_backfill`, or set
+GEO_BACKFILL_ON_STARTUP=1 to run it in the background when the agent starts.
+"""
+import asyncio
+from typing import Dict
+
+from .db import ensure_property_geo_table, get_properties_missing_coords, run_db, save_property_coords
+from .providers.weather import geocode_location
+
+
+async def backfill_property_coordinates(limit: int = 500, concurrency: int = 4) -> Dict[str, int]:
+    """Geocode properties without stored coordinates; returns simple counts."""
+    counts = {"scanned": 0, "stored": 0, "unresolved": 0}
+    if not await run_db(ensure_property_geo_table):
+        return counts
+
+    rows = await run_db(get_properties_missing_coords, limit=limit)
+    counts["scanned"] = len(rows)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(row: Dict):
+        async with semaphore:
+            coords = await geocode_location(row["location"])
+        if not coords:
+            counts["unresolved"] += 1
+            return
+        if await run_db(save_property_coords, row["property_id"], row["location"], coords[0], coords[1]):
+            counts["stored"] += 1
+
+    await asyncio.gather(*(_one(row) for row in rows))
+    return counts
+
+
+if __name__ == "__main__":
+    print(asyncio.run(backfill_property_coordinates()))
@@ -1,35 +1,83 @@
 # agent/main.py
+import asyncio
+import json
+import logging
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime, date
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi import FastAPI, HTTPException
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
 from .models import (
     BookingContext,
     ConciergeAsk,
+    ConciergeBatchItem,
+    ConciergeBatchRequest,
+    ConciergeBatchResponse,
     ConciergeChatRequest,
     ConciergeChatResponse,
     ConciergeResponse,
     Preferences,
 )
+from .chat_writer import chat_writer
 from .db import (
-    append_chat_message,
     ensure_chat_table,
-    get_booking_with_user,
+    ensure_concierge_plans_table,
+    ensure_property_geo_table,
     get_chat_history,
-    get_traveler_prefs,
+    load_booking_context,
+    request_scope,
+    run_db,
+    save_property_coords,
 )
+from .geo_backfill import backfill_property_coordinates
+from .precompute import PLAN_PRECOMPUTE_ENABLED, plan_store_stats, run_scheduler, serve_or_generate
+from .cache import cache_stats
+from .providers.http import close_http_clients, start_http_clients
+from .providers.llm_pool import LLMOverloaded, llm_pool
+from .providers.poi_index import poi_index
 from .providers.weather import geocode_location, get_weather_daily
-from .planner import generate_concierge
-from .chat_agent import run_concierge_chat
+from .planner import generate_concierge, stream_concierge
+from .singleflight import concierge_ask_key, concierge_flights
+from .chat_agent import run_concierge_chat, stream_concierge_chat
 
 load_dotenv()
 
-app = FastAPI(title="AI Concierge Agent")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_http_clients()
+    try:
+        await run_db(ensure_chat_table)
+    except Exception as exc:
+        # like the other tables: without a DB the agent still serves plans
+        logger.warning("chat_history table unavailable, chat will not be persisted: %s", exc)
+    await run_db(ensure_property_geo_table)
+    await run_db(ensure_concierge_plans_table)
+    await chat_writer.start()
+    background = []
+    if os.getenv("GEO_BACKFILL_ON_STARTUP", "").lower() in ("1", "true", "yes"):
+        background.append(asyncio.create_task(backfill_property_coordinates()))
+    if PLAN_PRECOMPUTE_ENABLED:
+        background.append(asyncio.create_task(run_scheduler(_prepare_concierge)))
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        await chat_writer.stop()
+        await close_http_clients()
+
+
+app = FastAPI(title="AI Concierge Agent", lifespan=lifespan)
 
 # allow your React origin(s)
 app.add_middleware(
@@ -38,6 +86,15 @@ app.add_middleware(
     allow_credentials=True, allow_methods=["*"], allow_headers=["*"]
 )
 
+
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded(request, exc: LLMOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Concierge is busy ({exc.reason}); please retry shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 def _coerce_date(value: Any) -> date:
     if value is None:
         raise ValueError("date value required")
@@ -52,15 +109,39 @@ def _coerce_date(value: Any) -> date:
 
 
 async def _build_concierge_response(ask: ConciergeAsk) -> ConciergeResponse:
-    # 1) if booking_id present, hydrate from DB
+    weather = await _prepare_concierge(ask)
+    # a stored (possibly precomputed) plan is reused while its inputs match
+    return await serve_or_generate(ask, weather)
+
+
+async def _prepare_concierge(ask: ConciergeAsk) -> Optional[Dict[str, Any]]:
+    """Fill in the ask from DB/geocoding (in place) and return the forecast, if any."""
+    with request_scope():
+        return await _prepare_concierge_scoped(ask)
+
+
+async def _prepare_concierge_scoped(ask: ConciergeAsk) -> Optional[Dict[str, Any]]:
+    row = await _hydrate_ask(ask)
+    await _resolve_coords(ask.booking, row)
+    return await _fetch_weather(ask.booking)
+
+
+async def _hydrate_ask(ask: ConciergeAsk) -> Optional[Dict[str, Any]]:
+    """Fill booking fields and prefs from the DB (in place); returns the booking row, if any."""
+    # if booking_id present, hydrate booking, property, coordinates and
+    # traveler prefs from DB in one query
     booking = ask.booking
+    row = None
     if booking.booking_id:
-        row = get_booking_with_user(booking.booking_id)
+        row = await load_booking_context(booking.booking_id)
         if not row: raise HTTPException(404, "Booking not found")
         booking.location = row.get("location") or booking.location
         booking.address = booking.address or row.get("property_address") or row.get("location")
         booking.guests = booking.guests or row.get("guests")
         booking.party_type = booking.party_type or row.get("party_type")
+        # precomputed property coordinates let us skip geocoding entirely
+        if (booking.lat is None or booking.lon is None) and row.get("lat") is not None and row.get("lon") is not None:
+            booking.lat, booking.lon = float(row["lat"]), float(row["lon"])
 
     if booking.address and not booking.location:
         booking.location = booking.address
@@ -68,40 +149,182 @@ async def _build_concierge_response(ask: ConciergeAsk) -> ConciergeResponse:
     if not booking.location:
         raise HTTPException(400, "location required (in booking or via booking_id)")
 
+    # if prefs not provided, use the ones hydrated with the booking
+    if ask.prefs is None and row and row.get("prefs"):
+        try:
+            ask.prefs = Preferences(**row["prefs"])
+        except ValueError:
+            pass  # malformed stored prefs shouldn't fail the plan
+    return row
+
+
+def _norm_place(value: str) -> str:
+    return " ".join((value or "").lower().split())
+
+
+async def _resolve_coords(
+    booking: BookingContext,
+    row: Optional[Dict[str, Any]],
+    coords: Optional[Tuple[float, float]] = None,
+):
+    """
+    Geocode the booking unless it has coordinates (or `coords` were resolved
+    already). Results are stored as the property's coordinates only when they
+    came from the property's own location, never from a client-sent address.
+    """
     target_location = booking.address or booking.location
     if target_location and (booking.lat is None or booking.lon is None):
-        coords = await geocode_location(target_location)
+        coords = coords or await geocode_location(target_location)
         if coords:
             booking.lat, booking.lon = coords
+            if (
+                row and row.get("property_id") and row.get("location")
+                and _norm_place(target_location) == _norm_place(row["location"])
+            ):
+                await run_db(save_property_coords, row["property_id"], row["location"], coords[0], coords[1])
 
-    # 2) Fetch weather when coordinates are available
-    weather = None
-    if booking.lat is not None and booking.lon is not None:
-        try:
-            weather = await get_weather_daily(booking.lat, booking.lon)
-        except Exception:
-            weather = None  # don't fail the whole request
 
-    # 3) if prefs not provided, try DB
-    if ask.prefs is None and booking.booking_id:
-        br = get_booking_with_user(booking.booking_id)
-        if br:
-            prefs = get_traveler_prefs(br["traveler_id"])
-            if prefs:
-                ask.prefs = Preferences(**prefs)
-
-    # 4) generate
-    return await generate_concierge(ask, weather_daily=weather)
+async def _fetch_weather(booking: BookingContext) -> Optional[Dict[str, Any]]:
+    # fetch weather when coordinates are available
+    if booking.lat is None or booking.lon is None:
+        return None
+    try:
+        return await get_weather_daily(booking.lat, booking.lon)
+    except Exception:
+        return None  # don't fail the whole request
 
 
 @app.post("/ai/concierge", response_model=ConciergeResponse)
 async def concierge(ask: ConciergeAsk):
-    return await _build_concierge_response(ask)
+    # double-clicks and refresh retries attach to the identical request already running
+    return await concierge_flights.do(concierge_ask_key(ask), lambda: _build_concierge_response(ask))
+
+
+CONCIERGE_BATCH_MAX_ASKS = int(os.getenv("CONCIERGE_BATCH_MAX_ASKS", "200"))
+CONCIERGE_BATCH_CONCURRENCY = max(1, int(os.getenv("CONCIERGE_BATCH_CONCURRENCY", "4")))
+
+
+def _batch_group_key(ask: ConciergeAsk) -> Tuple[str, date, date]:
+    b = ask.booking
+    if b.lat is not None and b.lon is not None:
+        place = f"{round(b.lat, 2)},{round(b.lon, 2)}"
+    else:
+        place = _norm_place(b.address or b.location)
+    return place, b.start_date, b.end_date
+
+
+def _batch_error(index: int, exc: Exception) -> ConciergeBatchItem:
+    if isinstance(exc, HTTPException):
+        return ConciergeBatchItem(index=index, ok=False, status=exc.status_code, error=str(exc.detail))
+    if isinstance(exc, LLMOverloaded):
+        return ConciergeBatchItem(index=index, ok=False, status=503, error=exc.reason)
+    return ConciergeBatchItem(index=index, ok=False, status=500, error=str(exc) or exc.__class__.__name__)
+
+
+@app.post("/ai/concierge/batch", response_model=ConciergeBatchResponse)
+async def concierge_batch(req: ConciergeBatchRequest):
+    """
+    Many asks in one call (e.g. a cohort of upcoming bookings). Asks are grouped
+    by location and dates: each group is geocoded and gets its forecast once,
+    searches are shared across every plan for the same location, and plans are
+    generated CONCIERGE_BATCH_CONCURRENCY at a time. One failing ask doesn't
+    fail the batch; results come back per item, in request order.
+    """
+    if len(req.asks) > CONCIERGE_BATCH_MAX_ASKS:
+        raise HTTPException(400, f"at most {CONCIERGE_BATCH_MAX_ASKS} asks per batch")
+
+    results: Dict[int, ConciergeBatchItem] = {}
+    with request_scope():
+        # 1) hydrate every ask from the DB (booking rows are memoized per batch)
+        hydrated = await asyncio.gather(*(_hydrate_ask(ask) for ask in req.asks), return_exceptions=True)
+        groups: Dict[Tuple[str, date, date], List[int]] = {}
+        rows: Dict[int, Optional[Dict[str, Any]]] = {}
+        for idx, (ask, row) in enumerate(zip(req.asks, hydrated)):
+            if isinstance(row, Exception):
+                results[idx] = _batch_error(idx, row)
+                continue
+            rows[idx] = row
+            groups.setdefault(_batch_group_key(ask), []).append(idx)
+
+        # 2) resolve coordinates and the forecast once per group; groups that
+        # share a place (different dates) also share the lookups
+        lookups: Dict[Any, "asyncio.Future"] = {}
+
+        def shared(key, factory):
+            if key not in lookups:
+                lookups[key] = asyncio.ensure_future(factory())
+            return lookups[key]
+
+        async def resolve_group(members: List[int]) -> Optional[Dict[str, Any]]:
+            lead = req.asks[members[0]].booking
+            if lead.lat is not None and lead.lon is not None:
+                coords = (lead.lat, lead.lon)
+            else:
+                target = lead.address or lead.location
+                coords = await shared(("geocode", _batch_group_key(req.asks[members[0]])[0]), lambda: geocode_location(target))
+                if not coords:
+                    return None
+                for idx in members:
+                    await _resolve_coords(req.asks[idx].booking, rows[idx], coords)
+            return await shared(("weather", coords), lambda: _fetch_weather(lead))
+
+        group_members = list(groups.values())
+        weathers = await asyncio.gather(*(resolve_group(m) for m in group_members), return_exceptions=True)
+
+        # 3) plan generation, bounded, sharing searches across the whole batch
+        semaphore = asyncio.Semaphore(CONCIERGE_BATCH_CONCURRENCY)
+        search_memo: Dict = {}
+
+        async def plan_one(idx: int, weather: Optional[Dict[str, Any]]):
+            async with semaphore:
+                try:
+                    response = await generate_concierge(req.asks[idx], weather_daily=weather, search_memo=search_memo)
+                    results[idx] = ConciergeBatchItem(index=idx, ok=True, response=response)
+                except Exception as exc:
+                    results[idx] = _batch_error(idx, exc)
+
+        jobs = []
+        for members, weather in zip(group_members, weathers):
+            if isinstance(weather, Exception):
+                weather = None  # as for single requests, a missing forecast doesn't fail the plan
+            jobs.extend(plan_one(idx, weather) for idx in members)
+        try:
+            await asyncio.gather(*jobs)
+        finally:
+            for task in search_memo.values():
+                task.cancel()
+
+    return ConciergeBatchResponse(
+        results=[results[idx] for idx in range(len(req.asks))],
+        groups=len(groups),
+    )
 
 
-@app.post("/ai/concierge/chat", response_model=ConciergeChatResponse)
-async def concierge_chat(req: ConciergeChatRequest):
-    context = dict(req.context or {})
+@app.post("/ai/concierge/stream")
+async def concierge_stream(ask: ConciergeAsk):
+    """
+    Progressive /ai/concierge as NDJSON: one event per line (see
+    planner.stream_concierge), days first, then the Gemini-refined plan.
+    """
+    weather = await _prepare_concierge(ask)
+
+    async def lines():
+        try:
+            async for event in stream_concierge(ask, weather_daily=weather):
+                yield json.dumps(jsonable_encoder(event)) + "\n"
+        except LLMOverloaded as exc:
+            # the heuristic plan is already out; say why no refinement follows
+            yield json.dumps({"type": "done", "source": "heuristic", "overloaded": True, "retry_after": exc.retry_after}) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _normalize_chat_context(context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    context = dict(context or {})
 
     active_booking = context.get("active_booking")
     active_location = None
@@ -142,6 +365,12 @@ async def concierge_chat(req: ConciergeChatRequest):
     if active_location:
         context["active_booking_location"] = active_location
 
+    return context
+
+
+@app.post("/ai/concierge/chat", response_model=ConciergeChatResponse)
+async def concierge_chat(req: ConciergeChatRequest):
+    context = _normalize_chat_context(req.context)
     reply = await run_concierge_chat(
         [msg.model_dump() for msg in req.messages],
         context
@@ -149,6 +378,27 @@ async def concierge_chat(req: ConciergeChatRequest):
     return ConciergeChatResponse(reply=reply)
 
 
+def _sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+
+@app.post("/ai/concierge/chat/stream")
+async def concierge_chat_stream(req: ConciergeChatRequest):
+    """Same as /ai/concierge/chat, streamed as Server-Sent Events (see stream_concierge_chat)."""
+    context = _normalize_chat_context(req.context)
+    messages = [msg.model_dump() for msg in req.messages]
+
+    async def events():
+        async for event in stream_concierge_chat(messages, context):
+            yield _sse(event)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 class LegacyChatRequest(BaseModel):
     booking: Optional[Dict[str, Any]] = None
     message: str
@@ -198,10 +448,9 @@ async def concierge_chat_legacy(payload: LegacyChatRequest):
         booking_raw["address"] = ask.booking.address
         booking_raw["property_address"] = ask.booking.address
 
-    # Persist conversation if DB is available
-    ensure_chat_table()
+    # Persist conversation if DB is available (batched by the write-behind queue)
     if booking.booking_id:
-        append_chat_message(booking.booking_id, "user", payload.message)
+        await chat_writer.enqueue(booking.booking_id, "user", payload.message)
 
     history_messages = payload.history or []
     chat_messages = []
@@ -218,7 +467,7 @@ async def concierge_chat_legacy(payload: LegacyChatRequest):
         reply = "Here is your updated concierge plan."
 
     if booking.booking_id:
-        append_chat_message(booking.booking_id, "assistant", reply)
+        await chat_writer.enqueue(booking.booking_id, "assistant", reply)
 
     return {
         "reply": reply,
@@ -235,13 +484,44 @@ async def health():
         "gemini_key_present": bool(os.getenv("GEMINI_API_KEY")),
         "tavily_key_present": bool(os.getenv("TAVILY_API_KEY")),
         "openweather_key_present": bool(os.getenv("OPENWEATHER_API_KEY")),
+        "caches": cache_stats(),
+        "poi_index": poi_index.stats(),
+        "llm_pool": llm_pool.stats(),
+        "concierge_singleflight": concierge_flights.stats(),
+        "plan_store": plan_store_stats(),
     }
 
 
+HISTORY_MAX_LIMIT = 500
+
+
 @app.get("/ai/history")
-async def history(booking_id: Optional[int] = None, limit: int = 200):
+async def history(
+    booking_id: Optional[int] = None,
+    limit: int = 200,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    latest: bool = False,
+):
+    """
+    Chat history for a booking, oldest-first. Page forward with `after_id`
+    or backward with `before_id` (or `latest=true` for the newest page);
+    `next_cursor` is the id to pass in the same direction, or null at the end.
+    """
     if not booking_id:
-        return {"history": []}
-    ensure_chat_table()
-    rows = get_chat_history(booking_id, limit=limit)
-    return {"history": rows}
+        return {"history": [], "next_cursor": None}
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    await chat_writer.flush()  # read-your-writes for messages still queued
+    rows = await run_db(
+        get_chat_history,
+        booking_id,
+        limit=limit,
+        before_id=before_id,
+        after_id=after_id,
+        latest=latest,
+    )
+    next_cursor = None
+    if len(rows) == limit:
+        backwards = before_id is not None or (latest and after_id is None)
+        next_cursor = rows[0]["id"] if backwards else rows[-1]["id"]
+    return {"history": rows, "next_cursor": next_cursor}
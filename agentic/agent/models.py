@@ -6,6 +6,7 @@ from datetime import date
 class BookingContext(BaseModel):
     booking_id: Optional[int] = None
     location: Optional[str] = None
+    address: Optional[str] = None
     lat: Optional[float] = None
     lon: Optional[float] = None
     start_date: date
@@ -49,6 +50,21 @@ class ConciergeResponse(BaseModel):
     reasoning_notes: List[str] = Field(default_factory=list)  # optional, for debugging
 
 
+class ConciergeBatchRequest(BaseModel):
+    asks: List[ConciergeAsk]
+
+class ConciergeBatchItem(BaseModel):
+    index: int  # position in the request's `asks`
+    ok: bool
+    response: Optional[ConciergeResponse] = None
+    status: Optional[int] = None  # HTTP-style status of a failed item
+    error: Optional[str] = None
+
+class ConciergeBatchResponse(BaseModel):
+    results: List[ConciergeBatchItem]
+    groups: int  # distinct (location, dates) groups resolved
+
+
 class ChatMessage(BaseModel):
     role: Literal["user", "assistant"]
     content: str
@@ -1,45 +1,37 @@
 # agent/planner.py
+import asyncio
+import os
 from datetime import datetime, timedelta, date as dt_date
-from typing import List, Dict, Any
+from typing import Any, AsyncIterator, Dict, List
 from .models import ConciergeAsk, ConciergeResponse, DayPlan, ActivityCard
-from .providers.search import search_pois
+from .ranking import CandidatePool, assign_slots, top_cards
+from .text_features import extract as extract_features, extract_many as extract_features_many
+from .providers.search import search_query_async
 from .providers.llm import generate_plan_with_gemini
 
+# Max number of provider searches in flight for one concierge request.
+SEARCH_CONCURRENCY = max(1, int(os.getenv("CONCIERGE_SEARCH_CONCURRENCY", "8")))
+
+BLOCK_NAMES = ("morning", "afternoon", "evening")
+CARDS_PER_BLOCK = 3
+RESTAURANT_LIMIT = 6
+# Tavily caps max_results at 20; longer stays ask for deeper result lists so
+# every day can get its own cards from a single search per query.
+MAX_RESULTS_CAP = 20
+
 # --- very light NLU (augment with LLM later if you want) ---
+# keyword tables live in text_features; each text is scanned once for all of them
 def parse_free_text(free:str) -> Dict:
     if not free: return {}
-    ft = free.lower()
-    prefs = {}
-    if "vegan" in ft: prefs["dietary"] = "vegan"
-    if "vegetarian" in ft and "vegan" not in ft: prefs["dietary"] = "vegetarian"
-    if "gluten" in ft: prefs["dietary"] = "gluten_free"
-    if "no long hikes" in ft or "no hiking" in ft or "limited walk" in ft:
-        prefs["mobility_needs"] = "limited_walk"
-    if "wheelchair" in ft: prefs["mobility_needs"] = "wheelchair"
-    if "kids" in ft or "children" in ft or "family" in ft:
-        prefs["child_friendly"] = True
-    # interests quick picks
-    interests = []
-    for k in ["museums","hikes","beach","nightlife","shopping","parks","zoos","aquariums","art","history","food tours"]:
-        if k in ft: interests.append(k)
-    if interests: prefs["interests"] = interests
-    return prefs
+    return extract_features(free)["prefs"]
 
 # --- heuristics to flag accessibility/kid-friendly from snippets ---
 def infer_flags(text:str):
-    t = text.lower() if text else ""
-    return {
-        "wheelchair_friendly": any(w in t for w in ["wheelchair accessible","step-free","accessible entrance"]),
-        "child_friendly": any(w in t for w in ["kids","family-friendly","children"]),
-    }
+    f = extract_features(text)
+    return {"wheelchair_friendly": f["wheelchair_friendly"], "child_friendly": f["child_friendly"]}
 
 def price_tier_from_text(text:str):
-    if not text: return None
-    t = text.lower()
-    if "$$$" in t or "expensive" in t: return "$$$"
-    if "$$" in t or "moderate" in t: return "$$"
-    if "$" in t or "cheap" in t or "budget" in t: return "$"
-    return None
+    return extract_features(text)["price_tier"]
 
 def plan_days(start, end) -> List:
     days = []
@@ -50,6 +42,8 @@ def plan_days(start, end) -> List:
     return days
 
 def build_queries(location:str, prefs:Dict, day:str, timeblock:str, dietary:str|None):
+    # `day` is kept for callers but queries are day-independent; the planner
+    # compiles them once per request (see compile_query_plan).
     q = []
     # time-of-day flavor
     if timeblock == "morning":
@@ -67,35 +61,98 @@ def build_queries(location:str, prefs:Dict, day:str, timeblock:str, dietary:str|
         q.append(f"{dietary} restaurants {location}")
     return q[:6]  # cap
 
-def make_activity_cards(hits:List[Dict], limit:int=3) -> List[ActivityCard]:
-    out = []
+def make_activity_cards(hits:List[Dict], limit:int|None=3) -> List[ActivityCard]:
     seen = set()
+    unique = []
     for h in hits:
         title = (h.get("title") or "").strip()
         if not title or title in seen: continue
         seen.add(title)
-        flags = infer_flags(h.get("content"))
+        unique.append((title, h))
+        if limit is not None and len(unique) >= limit: break
+    # flags and price tier for every card from one scan of each snippet
+    out = []
+    features = extract_features_many(h.get("content") for _, h in unique)
+    for (title, h), f in zip(unique, features):
         out.append(ActivityCard(
             title=title[:120],
             url=h.get("url"),
-            price_tier=price_tier_from_text(h.get("content")),
+            price_tier=f["price_tier"],
             duration_min=None,
             tags=[],
-            wheelchair_friendly=flags["wheelchair_friendly"],
-            child_friendly=flags["child_friendly"]
+            wheelchair_friendly=f["wheelchair_friendly"],
+            child_friendly=f["child_friendly"]
         ))
-        if len(out) >= limit: break
     return out
 
-async def generate_concierge(ask:ConciergeAsk, weather_daily:Dict|None=None) -> ConciergeResponse:
-    b = ask.booking
-    # merge explicit prefs + NLU from free_text
-    p = ask.prefs.dict() if ask.prefs else {}
-    p.update(parse_free_text(ask.free_text))
-    dietary = p.get("dietary","none")
-    location = b.location
+def _query_key(query:str) -> str:
+    return " ".join(query.lower().split())
 
-    # weather-aware packing and forecast context
+def compile_query_plan(location:str, prefs:Dict, dietary:str, num_days:int) -> Dict[str, Any]:
+    """
+    Build the per-request search plan. Block queries do not depend on the day,
+    so each unique query is listed once and searched deep enough to give every
+    day of the stay distinct hits.
+    {
+      "blocks": {block: [query, ...]},
+      "restaurants": [query, ...],
+      "searches": {query_key: {"query": str, "max_results": int}},
+    }
+    """
+    diet = None if dietary == "none" else dietary
+    block_depth = min(MAX_RESULTS_CAP, max(6, CARDS_PER_BLOCK * num_days))
+    blocks = {
+        block: build_queries(location, prefs, "", block, diet)
+        for block in BLOCK_NAMES
+    }
+    restaurants = [
+        f"{dietary} restaurants {location}" if dietary!="none" else f"best restaurants {location}",
+        f"family friendly restaurants {location}" if prefs.get("child_friendly") else f"popular eateries {location}"
+    ]
+
+    searches: Dict[str, Dict[str, Any]] = {}
+    def add(query:str, depth:int):
+        key = _query_key(query)
+        entry = searches.setdefault(key, {"query": query, "max_results": depth})
+        entry["max_results"] = max(entry["max_results"], depth)
+
+    for queries in blocks.values():
+        for q in queries:
+            add(q, block_depth)
+    for q in restaurants:
+        add(q, 12)
+    return {"blocks": blocks, "restaurants": restaurants, "searches": searches}
+
+def start_query_plan(location:str, plan:Dict[str, Any], semaphore:asyncio.Semaphore|None=None,
+                     search_memo:Dict|None=None) -> Dict[str, "asyncio.Task[List[Dict]]"]:
+    """
+    Start each unique search of the plan exactly once; returns a task per query key.
+    With `search_memo` (shared by several plans, e.g. a batch) a search another
+    plan already started for the same location is reused instead of repeated.
+    """
+    tasks = {}
+    for key, search in plan["searches"].items():
+        memo_key = (_query_key(location), key, search["max_results"])
+        task = search_memo.get(memo_key) if search_memo is not None else None
+        if task is None:
+            task = asyncio.ensure_future(search_query_async(
+                location,
+                search["query"],
+                max_results=search["max_results"],
+                semaphore=semaphore,
+            ))
+            if search_memo is not None:
+                search_memo[memo_key] = task
+        tasks[key] = task
+    return tasks
+
+async def _await_queries(tasks:Dict[str, "asyncio.Task[List[Dict]]"], queries:List[str]) -> Dict[str, List[Dict]]:
+    keys = list(dict.fromkeys(_query_key(q) for q in queries))
+    results = await asyncio.gather(*(tasks[key] for key in keys))
+    return dict(zip(keys, results))
+
+def _weather_context(weather_daily:Dict|None):
+    """Forecast summary for prompts plus a weather-aware packing list."""
     packing = []
     weather_forecast: List[Dict[str, Any]] = []
     weather_summary_text = None
@@ -144,67 +201,20 @@ async def generate_concierge(ask:ConciergeAsk, weather_daily:Dict|None=None) ->
             if any((w or {}).get("id", 0)//100 in (2,3,5) for w in (day0.get("weather") or [])):  # rain groups
                 packing += ["rain jacket","compact umbrella","waterproof shoes"]
     packing = list(dict.fromkeys(packing)) or ["comfortable shoes","daypack","charger"]
+    return packing, weather_forecast, weather_summary_text
 
-    # build day-by-day suggestions
-    days = plan_days(b.start_date, b.end_date)
-    dayplans = []
-    day_suggestions: List[Dict[str, Any]] = []
-    for d in days:
-        # morning / afternoon / evening
-        blocks = {"morning":[],"afternoon":[],"evening":[]}
-        suggestion_entry = {"date": str(d), "blocks": {}}
-        for block in blocks.keys():
-            qs = build_queries(location, p, str(d), block, None if dietary=="none" else dietary)
-            hits = search_pois(location, qs, max_results=6)
-            blocks[block] = make_activity_cards(hits, limit=3)
-            suggestion_entry["blocks"][block] = [
-                {
-                    "title": card.title,
-                    "url": card.url,
-                    "price_tier": card.price_tier,
-                    "tags": card.tags,
-                    "wheelchair_friendly": card.wheelchair_friendly,
-                    "child_friendly": card.child_friendly
-                }
-                for card in blocks[block]
-            ]
-        dayplans.append(DayPlan(date=d, **blocks))
-        day_suggestions.append(suggestion_entry)
-
-    # restaurants: run explicit dietary search
-    restaurants_hits = search_pois(location, [
-        f"{dietary} restaurants {location}" if dietary!="none" else f"best restaurants {location}",
-        f"family friendly restaurants {location}" if p.get("child_friendly") else f"popular eateries {location}"
-    ], max_results=12)
-    restaurants = make_activity_cards(restaurants_hits, limit=6)
-    restaurant_suggestions = [
-        {
-            "title": card.title,
-            "url": card.url,
-            "price_tier": card.price_tier,
-            "tags": card.tags,
-            "wheelchair_friendly": card.wheelchair_friendly,
-            "child_friendly": card.child_friendly
-        }
-        for card in restaurants
-    ]
-
-    notes = [
-        f"Preferences used: dietary={dietary}, mobility={p.get('mobility_needs','none')}, budget={p.get('budget','mid')}",
-        "Source: Tavily web search results (titles/snippets normalized).",
-        "Gemini assistance unavailable; returning heuristic itinerary."
-    ]
-    if weather_summary_text:
-        notes.append("Weather outlook: " + weather_summary_text)
-
-    base_response = ConciergeResponse(
-        plan=dayplans,
-        restaurants=restaurants,
-        packing_checklist=packing,
-        reasoning_notes=notes
-    )
+def _card_suggestion(card:ActivityCard) -> Dict[str, Any]:
+    return {
+        "title": card.title,
+        "url": card.url,
+        "price_tier": card.price_tier,
+        "tags": card.tags,
+        "wheelchair_friendly": card.wheelchair_friendly,
+        "child_friendly": card.child_friendly
+    }
 
-    # Attempt Gemini-enhanced plan
+def _build_llm_payload(b, location:str, p:Dict, weather_daily:Dict|None, weather_forecast, weather_summary_text,
+                       day_suggestions, restaurant_suggestions, packing) -> Dict[str, Any]:
     payload = {
         "booking": {
             "location": location,
@@ -233,10 +243,10 @@ async def generate_concierge(ask:ConciergeAsk, weather_daily:Dict|None=None) ->
         if weather_forecast:
             payload["weather"]["forecast"] = weather_forecast
 
-    llm_result = await generate_plan_with_gemini(payload)
-    if not llm_result:
-        return base_response
+    return payload
 
+def _merge_llm_result(llm_result:Dict, base:ConciergeResponse) -> ConciergeResponse|None:
+    """Turn Gemini's JSON into a ConciergeResponse, filling gaps from the heuristic plan."""
     try:
         plan_entries = []
         for day_entry in llm_result.get("plan", []):
@@ -289,7 +299,7 @@ async def generate_concierge(ask:ConciergeAsk, weather_daily:Dict|None=None) ->
 
         packing_llm = llm_result.get("packing_checklist")
         if not isinstance(packing_llm, list) or not packing_llm:
-            packing_llm = packing
+            packing_llm = base.packing_checklist
 
         reasoning = llm_result.get("reasoning_notes")
         if not isinstance(reasoning, list) or not reasoning:
@@ -298,11 +308,121 @@ async def generate_concierge(ask:ConciergeAsk, weather_daily:Dict|None=None) ->
             ]
 
         return ConciergeResponse(
-            plan=plan_entries or dayplans,
-            restaurants=restaurants_llm or restaurants,
+            plan=plan_entries or base.plan,
+            restaurants=restaurants_llm or base.restaurants,
             packing_checklist=[str(item) for item in packing_llm],
             reasoning_notes=[str(note) for note in reasoning]
         )
     except Exception:
         # Fallback to heuristic output if parsing fails
-        return base_response
+        return None
+
+async def stream_concierge(ask:ConciergeAsk, weather_daily:Dict|None=None, search_memo:Dict|None=None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Build the concierge plan progressively. Yields events in this order:
+      {"type": "meta", ...}                    stay length, packing list, weather overview
+      {"type": "day", "index": i, "day": DayPlan}   one per day, in date order
+      {"type": "restaurants", "restaurants": [...]}
+      {"type": "heuristic", "response": ConciergeResponse}
+      {"type": "plan", "response": ConciergeResponse}  Gemini refinement; replaces "heuristic"
+      {"type": "done", "source": "gemini" | "heuristic"}
+    `search_memo` shares search tasks across plans (see start_query_plan).
+    """
+    b = ask.booking
+    # merge explicit prefs + NLU from free_text
+    p = ask.prefs.dict() if ask.prefs else {}
+    p.update(parse_free_text(ask.free_text))
+    dietary = p.get("dietary","none")
+    location = b.location
+
+    # weather-aware packing and forecast context
+    packing, weather_forecast, weather_summary_text = _weather_context(weather_daily)
+
+    # compile one query plan for the whole stay and start each unique search
+    # once (concurrently); days are emitted as soon as the block searches land
+    days = plan_days(b.start_date, b.end_date)
+    query_plan = compile_query_plan(location, p, dietary, len(days))
+    tasks = start_query_plan(location, query_plan, semaphore=asyncio.Semaphore(SEARCH_CONCURRENCY), search_memo=search_memo)
+    yield {
+        "type": "meta",
+        "days": [str(d) for d in days],
+        "packing_checklist": packing,
+        "weather_overview": weather_summary_text,
+    }
+
+    try:
+        block_hits = await _await_queries(
+            tasks, [q for block in BLOCK_NAMES for q in query_plan["blocks"][block]]
+        )
+        # rank every hit against every block in one pass, then fill the
+        # day x block slots without repeating cards until the pool runs out
+        pool = CandidatePool(query_plan["blocks"], block_hits, key=_query_key)
+        block_cards = assign_slots(
+            pool, make_activity_cards(pool.hits, limit=None), p, location, len(days), CARDS_PER_BLOCK
+        )
+
+        dayplans = []
+        day_suggestions: List[Dict[str, Any]] = []
+        for day_idx, d in enumerate(days):
+            # morning / afternoon / evening
+            blocks = {block: block_cards[block][day_idx] for block in BLOCK_NAMES}
+            day_plan = DayPlan(date=d, **blocks)
+            dayplans.append(day_plan)
+            day_suggestions.append({
+                "date": str(d),
+                "blocks": {block: [_card_suggestion(card) for card in blocks[block]] for block in BLOCK_NAMES},
+            })
+            yield {"type": "day", "index": day_idx, "day": day_plan}
+
+        # restaurants: explicit dietary search, shared with the block searches
+        restaurant_hits = await _await_queries(tasks, query_plan["restaurants"])
+        restaurant_pool = CandidatePool({"restaurants": query_plan["restaurants"]}, restaurant_hits, key=_query_key)
+        restaurants = top_cards(
+            restaurant_pool,
+            make_activity_cards(restaurant_pool.hits, limit=None),
+            p,
+            location,
+            RESTAURANT_LIMIT,
+            shown={card.title for plan in dayplans for block in BLOCK_NAMES for card in getattr(plan, block)},
+        )
+        yield {"type": "restaurants", "restaurants": restaurants}
+    finally:
+        # a consumer that stops early shouldn't leave searches running
+        # (shared searches belong to the memo's owner)
+        if search_memo is None:
+            for task in tasks.values():
+                task.cancel()
+
+    notes = [
+        f"Preferences used: dietary={dietary}, mobility={p.get('mobility_needs','none')}, budget={p.get('budget','mid')}",
+        "Source: Tavily web search results (titles/snippets normalized).",
+        "Gemini assistance unavailable; returning heuristic itinerary."
+    ]
+    if weather_summary_text:
+        notes.append("Weather outlook: " + weather_summary_text)
+
+    base_response = ConciergeResponse(
+        plan=dayplans,
+        restaurants=restaurants,
+        packing_checklist=packing,
+        reasoning_notes=notes
+    )
+    yield {"type": "heuristic", "response": base_response}
+
+    # Attempt Gemini-enhanced plan
+    payload = _build_llm_payload(
+        b, location, p, weather_daily, weather_forecast, weather_summary_text,
+        day_suggestions, [_card_suggestion(card) for card in restaurants], packing,
+    )
+    llm_result = await generate_plan_with_gemini(payload)
+    refined = _merge_llm_result(llm_result, base_response) if llm_result else None
+    if refined is not None:
+        yield {"type": "plan", "response": refined}
+    yield {"type": "done", "source": "gemini" if refined is not None else "heuristic"}
+
+async def generate_concierge(ask:ConciergeAsk, weather_daily:Dict|None=None, search_memo:Dict|None=None) -> ConciergeResponse:
+    response = None
+    async for event in stream_concierge(ask, weather_daily, search_memo):
+        if event["type"] in ("heuristic", "plan"):
+            response = event["response"]
+    return response
@@ -0,0 +1,195 @@
+# agent/precompute.py
+"""
+Persisted concierge plans for upcoming bookings.
+
+A plan is stored per booking in the concierge_plans table together with a
+fingerprint of everything it was built from: the hydrated booking, the
+traveler's preferences, the forecast (rounded, so tiny revisions don't count)
+and the prompt version. /ai/concierge serves the stored plan while the
+fingerprint still matches, and writes fresh plans through.
+
+With PLAN_PRECOMPUTE_ENABLED=1 a background scheduler (started from the app
+lifespan) scans bookings starting within PLAN_PRECOMPUTE_HORIZON_DAYS, during
+the PLAN_PRECOMPUTE_HOURS off-peak window, and (re)computes any plan that is
+missing, stale, or whose inputs changed.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .db import get_concierge_plan, get_upcoming_bookings, run_db, save_concierge_plan
+from .models import BookingContext, ConciergeAsk, ConciergeResponse
+from .planner import stream_concierge
+from .providers.llm import PROMPT_VERSION, gemini_configured
+
+load_dotenv()
+
+PLAN_PRECOMPUTE_ENABLED = os.getenv("PLAN_PRECOMPUTE_ENABLED", "").lower() in ("1", "true", "yes")
+PLAN_PRECOMPUTE_HORIZON_DAYS = int(os.getenv("PLAN_PRECOMPUTE_HORIZON_DAYS", "7"))
+PLAN_PRECOMPUTE_INTERVAL = float(os.getenv("PLAN_PRECOMPUTE_INTERVAL", "3600"))
+# "start-end" in server-local hours, e.g. "1-5"; empty means any time
+PLAN_PRECOMPUTE_HOURS = os.getenv("PLAN_PRECOMPUTE_HOURS", "1-5")
+PLAN_PRECOMPUTE_CONCURRENCY = max(1, int(os.getenv("PLAN_PRECOMPUTE_CONCURRENCY", "2")))
+PLAN_PRECOMPUTE_LIMIT = int(os.getenv("PLAN_PRECOMPUTE_LIMIT", "200"))
+# stored plans older than this are recomputed even if their inputs match
+PLAN_STORE_MAX_AGE = float(os.getenv("PLAN_STORE_MAX_AGE", "172800"))
+_WINDOW_RECHECK = 300.0
+
+Prepare = Callable[[ConciergeAsk], Awaitable[Optional[Dict[str, Any]]]]
+
+_stats = {"served": 0, "stored": 0, "precomputed": 0, "unchanged": 0, "failed": 0, "passes": 0}
+
+
+def _weather_digest(weather: Optional[Dict[str, Any]]) -> Any:
+    if not weather:
+        return None
+    digest = []
+    for day in (weather.get("daily") or [])[:7]:
+        temps = day.get("temp") or {}
+        digest.append([
+            day.get("dt"),
+            (day.get("weather") or [{}])[0].get("description"),
+            round(temps["min"]) if temps.get("min") is not None else None,
+            round(temps["max"]) if temps.get("max") is not None else None,
+            round(day["pop"], 1) if day.get("pop") is not None else None,
+        ])
+    return digest
+
+
+def plan_fingerprint(ask: ConciergeAsk, weather: Optional[Dict[str, Any]]) -> str:
+    """Hash of a hydrated ask + forecast; equal fingerprints would produce the same plan."""
+    b = ask.booking
+    identity = {
+        "booking": [b.booking_id, b.location, b.address, str(b.start_date), str(b.end_date), b.guests, b.party_type],
+        "prefs": ask.prefs.model_dump() if ask.prefs else None,
+        "free_text": ask.free_text or None,
+        "weather": _weather_digest(weather),
+        "prompt": PROMPT_VERSION,
+    }
+    canonical = json.dumps(identity, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _storable(ask: ConciergeAsk) -> bool:
+    # only the plain per-booking plan is stored; free-text asks are one-offs
+    return bool(ask.booking.booking_id) and not (ask.free_text or "").strip()
+
+
+def _usable(stored: Optional[Dict[str, Any]], fingerprint: str) -> bool:
+    if not stored or stored.get("fingerprint") != fingerprint:
+        return False
+    if time.time() - float(stored.get("computed_at") or 0) > PLAN_STORE_MAX_AGE:
+        return False
+    # a heuristic fallback is only good enough while Gemini isn't configured
+    return stored.get("source") == "gemini" or not gemini_configured()
+
+
+async def _generate_with_source(ask: ConciergeAsk, weather: Optional[Dict[str, Any]]) -> Tuple[ConciergeResponse, str]:
+    response, source = None, "heuristic"
+    async for event in stream_concierge(ask, weather):
+        if event["type"] in ("heuristic", "plan"):
+            response = event["response"]
+        elif event["type"] == "done":
+            source = event["source"]
+    return response, source
+
+
+async def serve_or_generate(ask: ConciergeAsk, weather: Optional[Dict[str, Any]]) -> ConciergeResponse:
+    """Stored plan if its inputs still match, otherwise generate (and store) a new one."""
+    if not _storable(ask):
+        response, _ = await _generate_with_source(ask, weather)
+        return response
+
+    fingerprint = plan_fingerprint(ask, weather)
+    stored = await run_db(get_concierge_plan, ask.booking.booking_id)
+    if _usable(stored, fingerprint):
+        try:
+            response = ConciergeResponse.model_validate_json(stored["response"])
+            _stats["served"] += 1
+            return response
+        except ValueError:
+            pass  # schema drift: recompute below
+
+    response, source = await _generate_with_source(ask, weather)
+    if await run_db(save_concierge_plan, ask.booking.booking_id, fingerprint, source, response.model_dump_json()):
+        _stats["stored"] += 1
+    return response
+
+
+def _in_window(now: datetime) -> bool:
+    if not PLAN_PRECOMPUTE_HOURS.strip():
+        return True
+    try:
+        start, end = (int(part) for part in PLAN_PRECOMPUTE_HOURS.split("-", 1))
+    except ValueError:
+        return True
+    if start <= end:
+        return start <= now.hour <= end
+    return now.hour >= start or now.hour <= end  # window spans midnight
+
+
+def _as_date(value: Any) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+async def precompute_upcoming(prepare: Prepare, horizon_days: int = PLAN_PRECOMPUTE_HORIZON_DAYS) -> Dict[str, int]:
+    """One pass over bookings starting within the horizon; returns simple counts."""
+    counts = {"scanned": 0, "computed": 0, "unchanged": 0, "failed": 0}
+    today = date.today()
+    rows = await run_db(get_upcoming_bookings, today, today + timedelta(days=horizon_days), limit=PLAN_PRECOMPUTE_LIMIT)
+    counts["scanned"] = len(rows)
+    semaphore = asyncio.Semaphore(PLAN_PRECOMPUTE_CONCURRENCY)
+
+    async def _one(row: Dict[str, Any]):
+        async with semaphore:
+            try:
+                ask = ConciergeAsk(booking=BookingContext(
+                    booking_id=row["booking_id"],
+                    start_date=_as_date(row["start_date"]),
+                    end_date=_as_date(row["end_date"]),
+                ))
+                weather = await prepare(ask)
+                fingerprint = plan_fingerprint(ask, weather)
+                if _usable(await run_db(get_concierge_plan, row["booking_id"]), fingerprint):
+                    counts["unchanged"] += 1
+                    return
+                response, source = await _generate_with_source(ask, weather)
+                if await run_db(save_concierge_plan, row["booking_id"], fingerprint, source, response.model_dump_json()):
+                    counts["computed"] += 1
+            except Exception:
+                # e.g. LLMOverloaded: live traffic has priority; retried next pass
+                counts["failed"] += 1
+
+    await asyncio.gather(*(_one(row) for row in rows))
+    _stats["passes"] += 1
+    _stats["precomputed"] += counts["computed"]
+    _stats["unchanged"] += counts["unchanged"]
+    _stats["failed"] += counts["failed"]
+    return counts
+
+
+async def run_scheduler(prepare: Prepare):
+    """Background loop: a precompute pass every PLAN_PRECOMPUTE_INTERVAL seconds, off-peak only."""
+    while True:
+        if not _in_window(datetime.now()):
+            await asyncio.sleep(_WINDOW_RECHECK)
+            continue
+        try:
+            await precompute_upcoming(prepare)
+        except Exception:
+            pass  # a bad pass shouldn't kill the scheduler
+        await asyncio.sleep(PLAN_PRECOMPUTE_INTERVAL)
+
+
+def plan_store_stats() -> Dict[str, Any]:
+    return {"precompute_enabled": PLAN_PRECOMPUTE_ENABLED, **_stats}
@@ -0,0 +1,89 @@
+# agent/providers/http.py
+"""
+Application-scoped HTTP clients for the weather/geocoding providers.
+
+One keep-alive `httpx.AsyncClient` per provider host is opened in the FastAPI
+lifespan hook (see main.py), so each host gets its own connection limit and
+timeout and warm requests reuse pooled connections. The pool belongs to the
+event loop that opened it; anywhere else (scripts, worker threads running
+their own loop) `provider_client` falls back to a short-lived client.
+"""
+import asyncio
+import importlib.util
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROVIDER_TIMEOUTS: Dict[str, float] = {
+    "openweather": float(os.getenv("OPENWEATHER_TIMEOUT", "20")),
+    "open-meteo": float(os.getenv("OPENMETEO_TIMEOUT", "20")),
+    "open-meteo-geocoding": float(os.getenv("OPENMETEO_GEOCODING_TIMEOUT", "15")),
+}
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]").
+HTTP2_ENABLED = (
+    os.getenv("HTTP2_ENABLED", "").lower() in ("1", "true", "yes")
+    and importlib.util.find_spec("h2") is not None
+)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+# httpx clients can't be shared across event loops
+_clients_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _new_client(provider: str, pooled: bool) -> httpx.AsyncClient:
+    timeout = httpx.Timeout(PROVIDER_TIMEOUTS.get(provider, 20.0), connect=5.0)
+    if not pooled:
+        return httpx.AsyncClient(timeout=timeout)
+    return httpx.AsyncClient(
+        timeout=timeout,
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def start_http_clients():
+    """Open the pooled clients; call once from the app's lifespan hook."""
+    global _clients_loop
+    loop = asyncio.get_running_loop()
+    if _clients_loop is not loop:
+        # clients of a previous loop can't be closed from this one; drop them
+        _clients.clear()
+        _clients_loop = loop
+    for provider in PROVIDER_TIMEOUTS:
+        if provider not in _clients:
+            _clients[provider] = _new_client(provider, pooled=True)
+
+
+async def close_http_clients():
+    global _clients_loop
+    clients = list(_clients.values())
+    _clients.clear()
+    _clients_loop = None
+    for client in clients:
+        await client.aclose()
+
+
+@asynccontextmanager
+async def provider_client(provider: str) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Yield the pooled client for `provider`, or a one-off client if the pool
+    isn't running or belongs to another event loop.
+    """
+    client = _clients.get(provider) if asyncio.get_running_loop() is _clients_loop else None
+    if client is not None:
+        yield client
+        return
+    async with _new_client(provider, pooled=False) as temp:
+        yield temp
@@ -1,10 +1,13 @@
-import asyncio
+import hashlib
 import json
 import os
 from typing import Any, Dict, List, Optional
 
 from dotenv import load_dotenv
 
+from ..cache import FRESH, TieredCache
+from .llm_pool import LLMOverloaded, llm_pool
+
 load_dotenv()
 
 try:
@@ -15,6 +18,19 @@ except ImportError:  # pragma: no cover - dependency optional at runtime
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # Use Gemini 2f Flash model for concise, fast responses. Change if you want a different variant.
 MODEL_NAME ="gemini-2.5-flash"
+# Part of the plan cache key: bump whenever the prompt or schema below changes.
+PROMPT_VERSION = "plan-v1"
+
+# Identical payloads (same location, dates, prefs, suggestions and forecast)
+# reuse the previous plan instead of another multi-second Gemini call.
+# LLM_CACHE_TTL=0 disables the cache; LLM_CACHE_PERSIST=0 keeps it in memory.
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+_plan_cache = TieredCache(
+    "llm_plan",
+    ttl=LLM_CACHE_TTL,
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256")),
+    persist=os.getenv("LLM_CACHE_PERSIST", "1").lower() not in ("0", "false", "no"),
+)
 
 _model = None
 _model_error: Optional[Exception] = None
@@ -28,14 +44,31 @@ if GEMINI_API_KEY and genai is not None:
         _model = None
 
 
+def gemini_configured() -> bool:
+    return _model is not None
+
+
+def _plan_cache_key(payload: Dict[str, Any]) -> str:
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{MODEL_NAME}|{PROMPT_VERSION}|{canonical}".encode("utf-8")).hexdigest()
+
+
 async def generate_plan_with_gemini(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
     Ask Gemini to craft a concierge plan matching our JSON schema.
     Returns None on failure so callers can gracefully fall back.
+    Successful plans are cached by a hash of the payload, model and prompt version.
+    Raises LLMOverloaded when the LLM worker pool can't admit the call.
     """
     if _model is None:
         return None
 
+    cache_key = _plan_cache_key(payload) if LLM_CACHE_TTL > 0 else None
+    if cache_key is not None:
+        status, cached = _plan_cache.get(cache_key)
+        if status == FRESH:
+            return cached
+
     prompt = (
         "You are an enthusiastic travel concierge crafting detailed itineraries.\n"
         "Using the structured JSON context provided below, create a plan that matches this JSON schema:\n"
@@ -93,13 +126,11 @@ async def generate_plan_with_gemini(payload: Dict[str, Any]) -> Optional[Dict[st
             generation_config=generation_config,
         )
 
+    # LLMOverloaded propagates: the caller decides how to shed load
     try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    try:
-        response = await loop.run_in_executor(None, _invoke)
+        response = await llm_pool.run(_invoke)
+    except LLMOverloaded:
+        raise
     except Exception:  # pragma: no cover - runtime failure
         return None
 
@@ -122,6 +153,9 @@ async def generate_plan_with_gemini(payload: Dict[str, Any]) -> Optional[Dict[st
         return None
 
     try:
-        return json.loads(raw_text)
+        plan = json.loads(raw_text)
     except json.JSONDecodeError:
         return None
+    if cache_key is not None and isinstance(plan, dict):
+        _plan_cache.set(cache_key, plan)
+    return plan
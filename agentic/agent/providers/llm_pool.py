@@ -0,0 +1,114 @@
+# agent/providers/llm_pool.py
+"""
+Dedicated worker pool for blocking Gemini SDK calls, with admission control.
+
+At most LLM_MAX_CONCURRENCY calls run at once (sized to the provider quota,
+separately from the event loop's default executor). Up to LLM_MAX_QUEUE more
+wait for a slot, each for at most LLM_QUEUE_TIMEOUT seconds; anything beyond
+that is rejected right away with LLMOverloaded, which main.py turns into a
+503 with Retry-After instead of letting a burst pile up into rate-limit errors.
+"""
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "4")))
+LLM_MAX_QUEUE = max(0, int(os.getenv("LLM_MAX_QUEUE", "16")))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+
+
+class LLMOverloaded(Exception):
+    """The LLM pool is saturated; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LLMWorkerPool:
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._active = 0
+        self._stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0,
+            "completed": 0,
+        }
+
+    def _retry_after(self) -> int:
+        # rough time for the current backlog to drain
+        completed = self._stats["completed"]
+        avg_run = self._stats["run_seconds_total"] / completed if completed else self.queue_timeout
+        backlog = self._waiting + self._active
+        return max(1, math.ceil(avg_run * backlog / self.max_concurrency))
+
+    async def run(self, fn: Callable[[], Any]) -> Any:
+        """Run blocking `fn` on the pool once a slot frees up; raises LLMOverloaded instead of queueing forever."""
+        if self._active + self._waiting >= self.max_concurrency + self.max_queue:
+            self._stats["rejected_queue_full"] += 1
+            raise LLMOverloaded("LLM queue is full", self._retry_after())
+
+        queued_at = time.monotonic()
+        self._waiting += 1
+        try:
+            # asyncio.timeout, not wait_for: before 3.12 a wait_for timeout racing
+            # a release could swallow the acquired permit and shrink the pool
+            async with asyncio.timeout(self.queue_timeout):
+                await self._slots.acquire()
+        except TimeoutError:
+            self._stats["rejected_timeout"] += 1
+            raise LLMOverloaded("timed out waiting for an LLM slot", self._retry_after()) from None
+        finally:
+            self._waiting -= 1
+
+        waited = time.monotonic() - queued_at
+        self._stats["admitted"] += 1
+        self._stats["wait_seconds_total"] += waited
+        self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        self._active += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn)
+        finally:
+            self._active -= 1
+            self._stats["completed"] += 1
+            self._stats["run_seconds_total"] += time.monotonic() - started
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        data = dict(self._stats)
+        admitted, completed = data.pop("admitted"), data.pop("completed")
+        wait_total, run_total = data.pop("wait_seconds_total"), data.pop("run_seconds_total")
+        wait_max = data.pop("wait_seconds_max")
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queue_depth": self._waiting,
+            "admitted": admitted,
+            "completed": completed,
+            **data,
+            "wait_ms_avg": round(wait_total / admitted * 1000, 1) if admitted else None,
+            "wait_ms_max": round(wait_max * 1000, 1),
+            "run_ms_avg": round(run_total / completed * 1000, 1) if completed else None,
+        }
+
+
+llm_pool = LLMWorkerPool(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
@@ -0,0 +1,293 @@
+# agent/providers/poi_index.py
+"""
+Local POI corpus per destination, searched before Tavily.
+
+Every real Tavily hit (and anything bulk-imported) is stored per destination
+in a small SQLite table and indexed in memory: token -> {poi id: term freq},
+scored with BM25 (titles count double). A query is answered from here when
+enough POIs match every one of its terms to fill the request; otherwise
+Tavily is asked and the local matches top up its results. Each destination
+keeps its POI_INDEX_MAX_DOCS most recently stored POIs.
+
+Bulk import from JSON Lines ({"location", "title", "url", "content"} per line):
+    python -m agent.providers.poi_index import pois.jsonl
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from ..cache import CACHE_PATH
+
+load_dotenv()
+
+# Defaults to a file next to the cache store; an empty value keeps the index in memory only.
+POI_INDEX_PATH = os.getenv(
+    "POI_INDEX_PATH",
+    os.path.join(os.path.dirname(CACHE_PATH), "poi_index.sqlite3") if CACHE_PATH else "",
+)
+# per destination; the least recently stored POIs are evicted beyond this
+POI_INDEX_MAX_DOCS = max(1, int(os.getenv("POI_INDEX_MAX_DOCS", "5000")))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 2
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and at by for from in into near of on or the to with".split()
+)
+
+
+def _stem(token: str) -> str:
+    # plural folding only ("museums" -> "museum", "eateries" -> "eatery")
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return [_stem(t) for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def destination_key(location: str) -> str:
+    return " ".join((location or "").lower().split())
+
+
+def _poi_id(poi: Dict) -> str:
+    ident = (poi.get("url") or "").strip() or " ".join((poi.get("title") or "").lower().split())
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()[:16]
+
+
+class DestinationIndex:
+    """In-memory inverted index over one destination's POIs; BM25 ranking.
+
+    `_docs` keeps insertion order, and re-adding a POI moves it to the end, so
+    the first entry is always the least recently stored one.
+    """
+
+    def __init__(self, destination: str):
+        self.destination = destination
+        self._docs: Dict[str, Dict] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        # the destination's own name matches every POI; it carries no signal
+        self._ignore = set(tokenize(destination))
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, poi_id: str) -> bool:
+        return poi_id in self._docs
+
+    def _terms(self, poi: Dict) -> Dict[str, int]:
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokenize(poi.get("title")):
+            counts[token] += TITLE_WEIGHT
+        for token in tokenize(poi.get("content")):
+            counts[token] += 1
+        return counts
+
+    def _remove(self, poi_id: str):
+        old = self._docs.pop(poi_id, None)
+        if old is None:
+            return
+        for token in self._terms(old):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(poi_id, None)
+                if not postings:
+                    del self._postings[token]
+        self._total_length -= self._lengths.pop(poi_id, 0)
+
+    def add(self, poi_id: str, poi: Dict) -> List[str]:
+        """Store (or refresh) a POI; returns the ids evicted to make room."""
+        self._remove(poi_id)
+        evicted = []
+        while len(self._docs) >= POI_INDEX_MAX_DOCS:
+            oldest = next(iter(self._docs))
+            self._remove(oldest)
+            evicted.append(oldest)
+        terms = self._terms(poi)
+        self._docs[poi_id] = poi
+        for token, tf in terms.items():
+            self._postings[token][poi_id] = tf
+        self._lengths[poi_id] = sum(terms.values())
+        self._total_length += self._lengths[poi_id]
+        return evicted
+
+    def search(self, query: str, limit: int) -> List[Dict]:
+        """
+        Top POIs for `query` that match every informative term, so a qualifier
+        like "vegan" or "wheelchair" is never dropped from the query.
+        """
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t not in self._ignore]
+        if not terms or not self._docs:
+            return []
+        n = len(self._docs)
+        avg_len = self._total_length / n
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Dict[str, int] = defaultdict(int)
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for poi_id, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[poi_id] / avg_len)
+                scores[poi_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched[poi_id] += 1
+        ranked = sorted(
+            (poi_id for poi_id in scores if matched[poi_id] == len(terms)),
+            key=lambda poi_id: scores[poi_id],
+            reverse=True,
+        )
+        return [dict(self._docs[poi_id]) for poi_id in ranked[:limit]]
+
+
+class POIIndex:
+    """Per-destination indexes, loaded lazily from (and written through to) SQLite."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, DestinationIndex] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stats = {"local_answers": 0, "local_misses": 0, "added": 0, "evicted": 0}
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS pois (
+                        destination TEXT NOT NULL,
+                        poi_id TEXT NOT NULL,
+                        title TEXT,
+                        url TEXT,
+                        content TEXT,
+                        source TEXT,
+                        added_at REAL NOT NULL,
+                        PRIMARY KEY (destination, poi_id)
+                    )
+                """)
+            except Exception:  # pragma: no cover - disk issues fall back to memory
+                self._conn = None
+
+    def _index_for(self, destination: str) -> DestinationIndex:
+        # caller holds self._lock
+        index = self._indexes.get(destination)
+        if index is None:
+            index = DestinationIndex(destination)
+            if self._conn is not None:
+                rows = self._conn.execute(
+                    "SELECT poi_id, title, url, content FROM pois WHERE destination = ? ORDER BY added_at",
+                    (destination,),
+                ).fetchall()
+                evicted = []
+                for poi_id, title, url, content in rows:
+                    evicted.extend(index.add(poi_id, {"title": title, "url": url, "content": content}))
+                self._delete(destination, evicted)  # e.g. after POI_INDEX_MAX_DOCS was lowered
+            self._indexes[destination] = index
+        return index
+
+    def _delete(self, destination: str, poi_ids: List[str]):
+        # caller holds self._lock
+        if not poi_ids or self._conn is None:
+            return
+        try:
+            self._conn.executemany(
+                "DELETE FROM pois WHERE destination = ? AND poi_id = ?",
+                [(destination, poi_id) for poi_id in poi_ids],
+            )
+        except Exception:
+            pass  # stale rows are evicted again on the next load
+
+    def add(self, location: str, pois: Iterable[Dict], source: str = "tavily") -> int:
+        """Index POIs for a destination (re-adding a POI updates it); returns how many were stored."""
+        destination = destination_key(location)
+        if not destination:
+            return 0
+        rows = []
+        evicted = []
+        with self._lock:
+            index = self._index_for(destination)
+            for poi in pois:
+                title = (poi.get("title") or "").strip()
+                if not title:
+                    continue
+                record = {"title": title, "url": poi.get("url"), "content": poi.get("content")}
+                poi_id = _poi_id(record)
+                evicted.extend(index.add(poi_id, record))
+                rows.append((destination, poi_id, record["title"], record["url"], record["content"], source, time.time()))
+            # skip POIs already evicted again by later ones in this same call
+            rows = [row for row in rows if row[1] in index]
+            self._stats["added"] += len(rows)
+            self._stats["evicted"] += len(evicted)
+            self._delete(destination, evicted)
+            if rows and self._conn is not None:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO pois (destination, poi_id, title, url, content, source, added_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                except Exception:
+                    pass  # the in-memory index still has them
+        return len(rows)
+
+    def search(self, location: str, query: str, max_results: int) -> Tuple[List[Dict], bool]:
+        """
+        (local hits, complete). `complete` means they fill all `max_results`
+        and Tavily can be skipped; otherwise the hits are only a top-up.
+        """
+        with self._lock:
+            hits = self._index_for(destination_key(location)).search(query, max_results)
+            complete = len(hits) >= max_results
+            self._stats["local_answers" if complete else "local_misses"] += 1
+            return hits, complete
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "destinations_loaded": len(self._indexes),
+                "pois_loaded": sum(len(index) for index in self._indexes.values()),
+                "persisted": self._conn is not None,
+            }
+
+
+poi_index = POIIndex(POI_INDEX_PATH)
+
+
+def import_jsonl(path: str) -> int:
+    """Bulk-load POIs from a JSON Lines file; returns how many were stored."""
+    by_location: Dict[str, List[Dict]] = defaultdict(list)
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("location"):
+                by_location[record["location"]].append(record)
+    return sum(poi_index.add(location, pois, source="import") for location, pois in by_location.items())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "import":
+        sys.exit("usage: python -m agent.providers.poi_index import <pois.jsonl>")
+    print({"imported": import_jsonl(sys.argv[2])})
@@ -1,7 +1,14 @@
 # agent/providers/search.py
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+import asyncio
+import json
 import os
 import itertools
+import threading
+
+from ..cache import FRESH, STALE, TieredCache
+from .poi_index import poi_index
 
 try:
     from tavily import TavilyClient  # official SDK
@@ -16,6 +23,21 @@ if TAVILY_API_KEY and TavilyClient:
     except Exception:
         _client = None  # fall back to offline heuristics when SDK init fails
 
+SEARCH_DEPTH = "advanced"
+
+# Attraction lists change slowly: serve cached hits for SEARCH_CACHE_TTL seconds,
+# then keep serving them (while refreshing in the background) for another
+# SEARCH_CACHE_STALE_TTL seconds.
+_search_cache = TieredCache(
+    "search",
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600))),
+    stale_ttl=float(os.getenv("SEARCH_CACHE_STALE_TTL", str(24 * 3600))),
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048")),
+)
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-refresh")
+_refreshing: set = set()
+_refreshing_lock = threading.Lock()
+
 
 def _fallback_hits(location: str, query: str, limit: int) -> List[Dict]:
     """
@@ -41,33 +63,124 @@ def _fallback_hits(location: str, query: str, limit: int) -> List[Dict]:
     return hits
 
 
+def _cache_key(location: str, query: str, depth: str, max_results: int) -> str:
+    def norm(value: str) -> str:
+        return " ".join((value or "").lower().split())
+    return json.dumps([norm(location), norm(query), depth, int(max_results)])
+
+
+def _fetch_tavily(location: str, query: str, max_results: int) -> Tuple[List[Dict], bool]:
+    """
+    Run a single Tavily query. Returns (hits, from_provider); offline fallback
+    hits come back with from_provider=False so they never get cached.
+    """
+    full_q = f"{query} in {location}"
+    if _client is None:
+        return _fallback_hits(location, query, limit=min(3, max_results)), False
+
+    try:
+        resp = _client.search(full_q, search_depth=SEARCH_DEPTH, max_results=max_results)
+    except Exception:
+        # Network failures or API issues shouldn't break the concierge plan.
+        return _fallback_hits(location, query, limit=min(3, max_results)), False
+
+    results: List[Dict] = []
+    for item in resp.get("results", []):
+        results.append({
+            "title": item.get("title"),
+            "url": item.get("url"),
+            "content": item.get("content"),
+        })
+
+    # If Tavily returns nothing, ensure we still provide something helpful.
+    if not results:
+        return _fallback_hits(location, query, limit=min(3, max_results)), False
+    # grow the local corpus so future queries for this destination stay local
+    poi_index.add(location, results)
+    return results, True
+
+
+def _refresh(key: str, location: str, query: str, max_results: int):
+    try:
+        hits, from_provider = _fetch_tavily(location, query, max_results)
+        if from_provider:
+            _search_cache.set(key, hits)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def _schedule_refresh(key: str, location: str, query: str, max_results: int):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    _refresh_pool.submit(_refresh, key, location, query, max_results)
+
+
+def _search_one(location: str, query: str, max_results: int) -> List[Dict]:
+    """
+    Cached single-query search (stale entries are served while they refresh).
+    On a cache miss the local POI index answers if it can fill max_results;
+    otherwise the query goes to Tavily and local matches top up its hits.
+    """
+    key = _cache_key(location, query, SEARCH_DEPTH, max_results)
+    status, cached = _search_cache.get(key)
+    if status == FRESH:
+        return cached
+    if status == STALE:
+        _schedule_refresh(key, location, query, max_results)
+        return cached
+
+    local, complete = poi_index.search(location, query, max_results)
+    if complete:
+        return local
+
+    hits, from_provider = _fetch_tavily(location, query, max_results)
+    if not from_provider:
+        # real local matches beat the placeholder fallback
+        return local or hits
+    seen = {(h.get("url") or h.get("title")) for h in hits}
+    hits = hits + [h for h in local if (h.get("url") or h.get("title")) not in seen]
+    hits = hits[:max_results]
+    _search_cache.set(key, hits)
+    return hits
+
+
 def search_pois(location: str, queries: List[str], max_results: int = 10) -> List[Dict]:
     """Return structured search hits for POIs/events."""
     results: List[Dict] = []
-    if not queries:
-        return results
-
-    for q in queries:
-        full_q = f"{q} in {location}"
-        if _client is None:
-            results.extend(_fallback_hits(location, q, limit=min(3, max_results)))
-            continue
-
-        try:
-            resp = _client.search(full_q, search_depth="advanced", max_results=max_results)
-        except Exception:
-            # Network failures or API issues shouldn't break the concierge plan.
-            results.extend(_fallback_hits(location, q, limit=min(3, max_results)))
-            continue
-
-        for item in resp.get("results", []):
-            results.append({
-                "title": item.get("title"),
-                "url": item.get("url"),
-                "content": item.get("content"),
-            })
-
-        # If Tavily returns nothing, ensure we still provide something helpful.
-        if not resp.get("results"):
-            results.extend(_fallback_hits(location, q, limit=min(3, max_results)))
+    for q in queries or []:
+        results.extend(_search_one(location, q, max_results))
     return results
+
+
+async def search_query_async(
+    location: str,
+    query: str,
+    max_results: int = 10,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> List[Dict]:
+    """
+    Async variant of a single-query search. The Tavily SDK is blocking, so the
+    call runs in a worker thread; `semaphore` caps how many run at once.
+    """
+    if semaphore is None:
+        return await asyncio.to_thread(_search_one, location, query, max_results)
+    async with semaphore:
+        return await asyncio.to_thread(_search_one, location, query, max_results)
+
+
+async def search_pois_async(
+    location: str,
+    queries: List[str],
+    max_results: int = 10,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> List[Dict]:
+    """Concurrent `search_pois`: all queries run at once, hits keep query order."""
+    if not queries:
+        return []
+    batches = await asyncio.gather(*(
+        search_query_async(location, q, max_results, semaphore) for q in queries
+    ))
+    return [hit for batch in batches for hit in batch]
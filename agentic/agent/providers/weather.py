@@ -1,15 +1,45 @@
 # agent/providers/weather.py
 from __future__ import annotations
 
+import math
 import os
+import re
+import time
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import httpx
 from dotenv import load_dotenv
 
+from ..cache import FRESH, MISS, TieredCache
+from .http import provider_client
+
 load_dotenv()
 
+# Addresses don't move: keep hits for a month. Misses (the provider answered
+# but found nothing) are cached briefly so typos don't hammer the APIs.
+_geocode_cache = TieredCache(
+    "geocode",
+    ttl=float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600))),
+    max_entries=int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "4096")),
+)
+GEOCODE_NEGATIVE_TTL = float(os.getenv("GEOCODE_NEGATIVE_TTL", "3600"))
+
+# Forecasts are shared by every request whose coordinates fall in the same
+# grid cell (0.1 degrees is roughly 11 km) and expire when the source model
+# publishes its next run.
+WEATHER_GRID_DEG = float(os.getenv("WEATHER_GRID_DEG", "0.1"))
+WEATHER_REFRESH_SECONDS = {
+    "openweather": float(os.getenv("OPENWEATHER_REFRESH_SECONDS", "1800")),
+    "open-meteo": float(os.getenv("OPENMETEO_REFRESH_SECONDS", "3600")),
+}
+# Grace period after a scheduled refresh before we assume new data is live.
+WEATHER_REFRESH_LAG_SECONDS = 120.0
+_forecast_cache = TieredCache(
+    "forecast",
+    ttl=3600,
+    max_entries=int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "1024")),
+)
+
 
 def _weathercode_description(code: Optional[int]) -> str:
     mapping = {
@@ -47,19 +77,22 @@ def _weathercode_description(code: Optional[int]) -> str:
     return mapping.get(int(code), "Mixed weather")
 
 
-async def geocode_location(location: str) -> Optional[Tuple[float, float]]:
+def _geocode_key(location: str) -> str:
+    key = " ".join(location.lower().split())
+    key = re.sub(r"\s*,\s*", ", ", key)
+    return key.strip(" ,.")
+
+
+async def _geocode_remote(location: str) -> Tuple[Optional[Tuple[float, float]], bool]:
     """
-    Resolve a textual location to latitude/longitude using OpenWeather when
-    available and falling back to Open-Meteo's geocoding API otherwise.
+    Resolve a location against the providers. Returns (coords, definitive);
+    definitive is False when the lookup errored, so the miss isn't cached.
     """
-    if not location:
-        return None
-
     ow_key = os.getenv("OPENWEATHER_API_KEY")
     if ow_key:
         url = "https://api.openweathermap.org/geo/1.0/direct"
         params = {"q": location, "limit": 1, "appid": ow_key}
-        async with httpx.AsyncClient(timeout=15.0) as client:
+        async with provider_client("openweather") as client:
             try:
                 resp = await client.get(url, params=params)
                 resp.raise_for_status()
@@ -72,34 +105,56 @@ async def geocode_location(location: str) -> Optional[Tuple[float, float]]:
             lon = first.get("lon")
             if lat is not None and lon is not None:
                 try:
-                    return float(lat), float(lon)
+                    return (float(lat), float(lon)), True
                 except (TypeError, ValueError):
                     pass
 
     # Fallback: Open-Meteo geocoding (no API key required)
     url = "https://geocoding-api.open-meteo.com/v1/search"
     params = {"name": location, "count": 1, "language": "en", "format": "json"}
-    async with httpx.AsyncClient(timeout=15.0) as client:
+    async with provider_client("open-meteo-geocoding") as client:
         try:
             resp = await client.get(url, params=params)
             resp.raise_for_status()
             data = resp.json()
         except Exception:
-            return None
+            return None, False
 
     results = data.get("results") if isinstance(data, dict) else None
     if not results:
-        return None
+        return None, True
     primary = results[0]
     lat = primary.get("latitude")
     lon = primary.get("longitude")
     if lat is None or lon is None:
-        return None
+        return None, True
     try:
-        return float(lat), float(lon)
+        return (float(lat), float(lon)), True
     except (TypeError, ValueError):
+        return None, True
+
+
+async def geocode_location(location: str) -> Optional[Tuple[float, float]]:
+    """
+    Resolve a textual location to latitude/longitude using OpenWeather when
+    available and falling back to Open-Meteo's geocoding API otherwise.
+    Results (including "not found") are cached under a normalized key.
+    """
+    if not location or not location.strip():
         return None
 
+    key = _geocode_key(location)
+    status, cached = _geocode_cache.get(key)
+    if status != MISS:
+        return tuple(cached) if cached else None
+
+    coords, definitive = await _geocode_remote(location)
+    if coords:
+        _geocode_cache.set(key, list(coords))
+    elif definitive:
+        _geocode_cache.set(key, None, ttl=GEOCODE_NEGATIVE_TTL)
+    return coords
+
 
 async def _fetch_openweather(lat: float, lon: float, key: str) -> Dict:
     url = "https://api.openweathermap.org/data/2.5/onecall"
@@ -110,7 +165,7 @@ async def _fetch_openweather(lat: float, lon: float, key: str) -> Dict:
         "units": "metric",
         "appid": key,
     }
-    async with httpx.AsyncClient(timeout=20.0) as client:
+    async with provider_client("openweather") as client:
         resp = await client.get(url, params=params)
         resp.raise_for_status()
         payload = resp.json()
@@ -127,7 +182,7 @@ async def _fetch_openmeteo(lat: float, lon: float) -> Dict:
         "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max,weathercode",
         "timezone": "UTC",
     }
-    async with httpx.AsyncClient(timeout=20.0) as client:
+    async with provider_client("open-meteo") as client:
         resp = await client.get(url, params=params)
         resp.raise_for_status()
         raw = resp.json()
@@ -161,12 +216,23 @@ async def _fetch_openmeteo(lat: float, lon: float) -> Dict:
     return {"daily": converted, "source": "open-meteo"}
 
 
-async def get_weather_daily(lat: float, lon: float) -> Dict:
-    """
-    Return a normalized weather payload containing a `daily` list.
-    Tries OpenWeather when an API key is configured; falls back to
-    Open-Meteo otherwise.
-    """
+def _grid_cell(lat: float, lon: float) -> Tuple[float, float]:
+    """Snap coordinates to the centre of their WEATHER_GRID_DEG cell."""
+    step = WEATHER_GRID_DEG
+    if step <= 0:
+        return round(lat, 4), round(lon, 4)
+    cell_lat = (math.floor(lat / step) + 0.5) * step
+    cell_lon = (math.floor(lon / step) + 0.5) * step
+    return round(cell_lat, 4), round(cell_lon, 4)
+
+
+def _forecast_ttl(source: Optional[str]) -> float:
+    """Seconds until the source's next model refresh (plus a small lag)."""
+    interval = WEATHER_REFRESH_SECONDS.get(source or "", WEATHER_REFRESH_SECONDS["open-meteo"])
+    return interval - (time.time() % interval) + WEATHER_REFRESH_LAG_SECONDS
+
+
+async def _get_weather_uncached(lat: float, lon: float) -> Dict:
     key = os.getenv("OPENWEATHER_API_KEY")
     if key:
         try:
@@ -175,3 +241,21 @@ async def get_weather_daily(lat: float, lon: float) -> Dict:
             pass  # fall through to Open-Meteo
     # fallback to Open-Meteo (no key required)
     return await _fetch_openmeteo(lat, lon)
+
+
+async def get_weather_daily(lat: float, lon: float) -> Dict:
+    """
+    Return a normalized weather payload containing a `daily` list.
+    Tries OpenWeather when an API key is configured; falls back to
+    Open-Meteo otherwise. Forecasts are cached per grid cell.
+    """
+    cell_lat, cell_lon = _grid_cell(lat, lon)
+    cache_key = f"{cell_lat:.4f},{cell_lon:.4f}"
+    status, cached = _forecast_cache.get(cache_key)
+    if status == FRESH:
+        return cached
+
+    payload = await _get_weather_uncached(cell_lat, cell_lon)
+    if isinstance(payload, dict) and payload.get("daily"):
+        _forecast_cache.set(cache_key, payload, ttl=_forecast_ttl(payload.get("source")))
+    return payload
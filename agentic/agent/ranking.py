@@ -0,0 +1,206 @@
+# agent/ranking.py
+"""
+Ranking and slot assignment for itinerary cards.
+
+All hits of a request are pooled into candidates (one per title, remembering
+which queries returned them and at what position), scored in one NumPy pass
+against every block, then assigned to day x block slots greedily with a
+diversity constraint: a card is never repeated within a day, is only reused
+on another day once the block has no unused candidates left, and picks from
+the same site on the same day are discouraged.
+
+Score features (weights below):
+  query     share of a block query's terms found in the hit (best query)
+  prior     provider rank, 1 / (1 + position)
+  support   how many of the block's queries returned the hit
+  interest  share of the traveler's interests mentioned
+  dietary   the traveler's dietary need is mentioned (e.g. "vegan")
+  access    wheelchair-friendly when mobility_needs == "wheelchair"
+  child     child-friendly when the party includes kids
+  price     price tier vs. budget (unknown tiers are neutral)
+"""
+import re
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .models import ActivityCard
+
+W_QUERY = 1.0
+W_PRIOR = 0.6
+W_SUPPORT = 0.3
+W_INTEREST = 0.8
+W_DIETARY = 0.8
+W_ACCESS = 0.5
+W_CHILD = 0.4
+W_PRICE = 0.3
+# larger than any score difference: unused candidates always beat reused ones
+REUSE_PENALTY = 10.0
+SAME_SITE_PENALTY = 0.25
+# top_cards: cards already shown elsewhere in the plan (less than W_DIETARY,
+# so a matching card that is already in the days still beats a generic one)
+SHOWN_PENALTY = 0.3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("a an and at by for from in into near of on or the to with".split())
+_BUDGET_TIER = {"low": 0, "mid": 1, "high": 2}
+_PRICE_TIER = {"$": 0, "$$": 1, "$$$": 2}
+
+
+def _tokens(text: Optional[str]) -> Set[str]:
+    return {t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS}
+
+
+class CandidatePool:
+    """
+    Unique hits (by title, like make_activity_cards) across a set of query
+    groups, e.g. {"morning": [q, ...], "afternoon": [...]}.
+    """
+
+    def __init__(self, groups: Dict[str, List[str]], hits_by_query: Dict[str, List[Dict]], key=None):
+        key = key or (lambda q: " ".join(q.lower().split()))
+        self.groups = list(groups)
+        self.queries: List[str] = []
+        self.query_group: List[int] = []
+        self.hits: List[Dict] = []
+        index: Dict[str, int] = {}
+        positions: Dict[tuple, int] = {}
+        for gi, group in enumerate(self.groups):
+            for query in groups[group]:
+                qi = len(self.queries)
+                self.queries.append(query)
+                self.query_group.append(gi)
+                for pos, hit in enumerate(hits_by_query.get(key(query)) or []):
+                    title = (hit.get("title") or "").strip()
+                    if not title:
+                        continue
+                    if title not in index:
+                        index[title] = len(self.hits)
+                        self.hits.append(hit)
+                    ci = index[title]
+                    positions[(ci, qi)] = min(pos, positions.get((ci, qi), pos))
+        # position prior per (candidate, query); 0 where the query didn't return it
+        self.prior = np.zeros((len(self.hits), len(self.queries)))
+        for (ci, qi), pos in positions.items():
+            self.prior[ci, qi] = 1.0 / (1.0 + pos)
+        hosts: Dict[str, int] = {}
+        self.host_ids = np.array(
+            [hosts.setdefault(urlparse(h.get("url") or "").netloc.lower(), len(hosts)) for h in self.hits],
+            dtype=int,
+        )
+        self.num_hosts = len(hosts)
+
+    def __len__(self) -> int:
+        return len(self.hits)
+
+
+def score_pool(pool: CandidatePool, cards: List[ActivityCard], prefs: Dict, location: str) -> np.ndarray:
+    """(candidates x groups) scores; -inf where no query of the group returned the candidate."""
+    n, groups = len(pool), len(pool.groups)
+    if n == 0:
+        return np.zeros((0, groups))
+    ignore = _tokens(location)
+    query_tokens = [_tokens(q) - ignore for q in pool.queries]
+    interests = [_tokens(i) - ignore for i in prefs.get("interests") or []]
+    interests = [i for i in interests if i]
+    dietary = prefs.get("dietary")
+    dietary_tokens = _tokens(dietary.replace("_", " ")) if dietary and dietary != "none" else set()
+    vocab: Dict[str, int] = {}
+    for tokens in query_tokens + interests + [dietary_tokens]:
+        for t in tokens:
+            vocab.setdefault(t, len(vocab))
+
+    # candidate x vocab term presence, built once; every feature is a matrix op on it
+    present = np.zeros((n, max(1, len(vocab))))
+    for ci, hit in enumerate(pool.hits):
+        for t in _tokens(f"{hit.get('title') or ''} {hit.get('content') or ''}"):
+            vi = vocab.get(t)
+            if vi is not None:
+                present[ci, vi] = 1.0
+
+    def term_matrix(token_sets):
+        m = np.zeros((len(token_sets), present.shape[1]))
+        for row, tokens in enumerate(token_sets):
+            for t in tokens:
+                m[row, vocab[t]] = 1.0
+        return m
+
+    q_terms = term_matrix(query_tokens)
+    q_sizes = np.maximum(q_terms.sum(axis=1), 1.0)
+    query_match = (present @ q_terms.T) / q_sizes  # (n, queries)
+
+    query_group = np.array(pool.query_group)
+    member = query_group[None, :] == np.arange(groups)[:, None]  # (groups, queries)
+    returned = pool.prior > 0
+    group_query = np.where(member[None, :, :], query_match[:, None, :], 0.0).max(axis=2)
+    group_prior = np.where(member[None, :, :], pool.prior[:, None, :], 0.0).max(axis=2)
+    group_support = (returned[:, None, :] & member[None, :, :]).sum(axis=2) / np.maximum(member.sum(axis=1), 1)
+    eligible = (returned[:, None, :] & member[None, :, :]).any(axis=2)
+
+    shared = np.zeros(n)
+    if interests:
+        i_terms = term_matrix(interests)
+        shared += W_INTEREST * ((present @ i_terms.T) >= i_terms.sum(axis=1)).mean(axis=1)
+    if dietary_tokens:
+        d_terms = term_matrix([dietary_tokens])
+        shared += W_DIETARY * ((present @ d_terms.T)[:, 0] >= len(dietary_tokens))
+    if prefs.get("mobility_needs") == "wheelchair":
+        shared += W_ACCESS * np.array([bool(c.wheelchair_friendly) for c in cards], dtype=float)
+    if prefs.get("child_friendly"):
+        shared += W_CHILD * np.array([bool(c.child_friendly) for c in cards], dtype=float)
+    tiers = np.array([_PRICE_TIER.get(c.price_tier, np.nan) for c in cards], dtype=float)
+    target = _BUDGET_TIER.get(prefs.get("budget") or "mid", 1)
+    shared += W_PRICE * np.where(np.isnan(tiers), 0.5, 1.0 - np.abs(tiers - target) / 2.0)
+
+    scores = W_QUERY * group_query + W_PRIOR * group_prior + W_SUPPORT * group_support + shared[:, None]
+    return np.where(eligible, scores, -np.inf)
+
+
+def assign_slots(
+    pool: CandidatePool,
+    cards: List[ActivityCard],
+    prefs: Dict,
+    location: str,
+    num_days: int,
+    per_block: int,
+) -> Dict[str, List[List[ActivityCard]]]:
+    """Fill days x groups x per_block slots (round-robin, so top picks spread over the stay)."""
+    slots = {group: [[] for _ in range(num_days)] for group in pool.groups}
+    if not len(pool):
+        return slots
+    scores = score_pool(pool, cards, prefs, location)
+    uses = np.zeros(len(pool))
+    used_today = np.zeros((num_days, len(pool)), dtype=bool)
+    sites_today = np.zeros((num_days, pool.num_hosts))
+    for _ in range(per_block):
+        for day in range(num_days):
+            for gi, group in enumerate(pool.groups):
+                adjusted = scores[:, gi] - REUSE_PENALTY * uses - SAME_SITE_PENALTY * sites_today[day, pool.host_ids]
+                adjusted[used_today[day]] = -np.inf
+                best = int(np.argmax(adjusted))
+                if not np.isfinite(adjusted[best]):
+                    continue
+                slots[group][day].append(cards[best])
+                uses[best] += 1
+                used_today[day, best] = True
+                sites_today[day, pool.host_ids[best]] = 1.0
+    return slots
+
+
+def top_cards(
+    pool: CandidatePool,
+    cards: List[ActivityCard],
+    prefs: Dict,
+    location: str,
+    limit: int,
+    shown: Optional[Set[str]] = None,
+) -> List[ActivityCard]:
+    """Best `limit` cards of a single-group pool; titles in `shown` are down-weighted, not dropped."""
+    if not len(pool):
+        return []
+    scores = score_pool(pool, cards, prefs, location).max(axis=1)
+    if shown:
+        scores -= SHOWN_PENALTY * np.array([c.title in shown for c in cards], dtype=float)
+    order = np.argsort(-scores, kind="stable")
+    return [cards[i] for i in order[:limit] if np.isfinite(scores[i])]
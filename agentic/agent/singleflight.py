@@ -0,0 +1,69 @@
+# agent/singleflight.py
+"""
+Request coalescing: concurrent callers with the same key share one execution.
+
+The first caller for a key starts the work as a task; callers arriving while it
+is in flight await that same task instead of starting their own. The task is
+shielded, so a caller that disconnects doesn't cancel it for the others. Keys
+are forgotten as soon as the work finishes -- this is not a result cache.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from .models import ConciergeAsk
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is not None:
+            self._stats["coalesced"] += 1
+        else:
+            self._stats["executions"] += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "in_flight": len(self._calls)}
+
+
+def _norm_text(value: Any) -> Any:
+    return " ".join(value.lower().split()) if isinstance(value, str) else value
+
+
+def concierge_ask_key(ask: ConciergeAsk) -> str:
+    """Stable key for asks that would produce the same plan."""
+    b = ask.booking
+    prefs = ask.prefs.model_dump() if ask.prefs else None
+    if prefs:
+        prefs["interests"] = sorted({_norm_text(i) for i in prefs.get("interests") or []})
+    identity = {
+        "booking": [
+            b.booking_id, _norm_text(b.location), _norm_text(b.address), b.lat, b.lon,
+            b.guests, _norm_text(b.party_type),
+        ],
+        "dates": [str(b.start_date), str(b.end_date)],
+        "prefs": prefs,
+        "free_text": _norm_text(ask.free_text) or None,
+    }
+    canonical = json.dumps(identity, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+concierge_flights = SingleFlight()
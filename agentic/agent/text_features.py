@@ -0,0 +1,147 @@
+# agent/text_features.py
+"""
+Keyword features for the planner heuristics, extracted in one pass per text.
+
+All keywords from KEYWORDS are compiled once, at import, into an
+Aho-Corasick automaton. A scan walks the lowercased text once and reports
+every keyword occurring anywhere in it (overlapping matches included, so
+"$$$" also yields "$$" and "$"), i.e. the same substring semantics as the
+`in` checks it replaces. Precedence between matches of the same feature
+(price tier, dietary, mobility) is declared in the *_ORDER tables.
+"""
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+# signal -> keywords (lowercase substrings)
+KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    # search-hit flags
+    "flag:wheelchair_friendly": ("wheelchair accessible", "step-free", "accessible entrance"),
+    "flag:child_friendly": ("kids", "family-friendly", "children"),
+    "price:$$$": ("$$$", "expensive"),
+    "price:$$": ("$$", "moderate"),
+    "price:$": ("$", "cheap", "budget"),
+    # traveler free text
+    "dietary:vegan": ("vegan",),
+    "dietary:vegetarian": ("vegetarian",),
+    "dietary:gluten_free": ("gluten",),
+    "mobility:limited_walk": ("no long hikes", "no hiking", "limited walk"),
+    "mobility:wheelchair": ("wheelchair",),
+    "party:child_friendly": ("kids", "children", "family"),
+    "interest:museums": ("museums",),
+    "interest:hikes": ("hikes",),
+    "interest:beach": ("beach",),
+    "interest:nightlife": ("nightlife",),
+    "interest:shopping": ("shopping",),
+    "interest:parks": ("parks",),
+    "interest:zoos": ("zoos",),
+    "interest:aquariums": ("aquariums",),
+    "interest:art": ("art",),
+    "interest:history": ("history",),
+    "interest:food tours": ("food tours",),
+}
+
+# first match wins
+PRICE_ORDER = ("$$$", "$$", "$")
+DIETARY_ORDER = ("gluten_free", "vegan", "vegetarian")
+MOBILITY_ORDER = ("wheelchair", "limited_walk")
+# interests are reported in KEYWORDS order
+INTEREST_ORDER = tuple(s.split(":", 1)[1] for s in KEYWORDS if s.startswith("interest:"))
+
+
+class KeywordAutomaton:
+    """Aho-Corasick matcher: keyword -> signals, all matches in one pass."""
+
+    def __init__(self, table: Dict[str, Iterable[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[FrozenSet[str]] = [frozenset()]
+        outputs: List[set] = [set()]
+        for signal, keywords in table.items():
+            for keyword in keywords:
+                state = 0
+                for ch in keyword:
+                    nxt = self._goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(self._goto)
+                        self._goto[state][ch] = nxt
+                        self._goto.append({})
+                        outputs.append(set())
+                    state = nxt
+                outputs[state].add(signal)
+
+        # failure links, breadth first; each state also reports its fallbacks' outputs
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                outputs[nxt] |= outputs[self._fail[nxt]]
+                queue.append(nxt)
+        self._out = [frozenset(o) for o in outputs]
+
+    def scan(self, text: Optional[str]) -> FrozenSet[str]:
+        """Signals of every keyword found in `text` (case-insensitive)."""
+        if not text:
+            return frozenset()
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return frozenset(found)
+
+
+_automaton = KeywordAutomaton(KEYWORDS)
+
+
+def _first(signals: FrozenSet[str], prefix: str, order: Tuple[str, ...]) -> Optional[str]:
+    for value in order:
+        if f"{prefix}:{value}" in signals:
+            return value
+    return None
+
+
+def extract(text: Optional[str]) -> Dict:
+    """
+    Every feature of one text:
+    {"wheelchair_friendly", "child_friendly", "price_tier", "prefs"}, where
+    "prefs" is what parse_free_text reads from traveler free text.
+    """
+    signals = _automaton.scan(text)
+    prefs: Dict = {}
+    dietary = _first(signals, "dietary", DIETARY_ORDER)
+    if dietary:
+        prefs["dietary"] = dietary
+    mobility = _first(signals, "mobility", MOBILITY_ORDER)
+    if mobility:
+        prefs["mobility_needs"] = mobility
+    if "party:child_friendly" in signals:
+        prefs["child_friendly"] = True
+    interests = [i for i in INTEREST_ORDER if f"interest:{i}" in signals]
+    if interests:
+        prefs["interests"] = interests
+    return {
+        "wheelchair_friendly": "flag:wheelchair_friendly" in signals,
+        "child_friendly": "flag:child_friendly" in signals,
+        "price_tier": _first(signals, "price", PRICE_ORDER),
+        "prefs": prefs,
+    }
+
+
+def extract_many(texts: Iterable[Optional[str]]) -> List[Dict]:
+    """extract() over a batch; repeated texts (the same snippet from several queries) are scanned once."""
+    memo: Dict[Optional[str], Dict] = {}
+    results = []
+    for text in texts:
+        features = memo.get(text)
+        if features is None:
+            features = memo[text] = extract(text)
+        results.append(features)
+    return results